@@ -0,0 +1,137 @@
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+
+from intent_parser import normalize
+
+# -----------------------------
+# ask_agent response cache
+# -----------------------------
+# Customers repeat the same phrasings ("mau pesan", "sudah", "terima
+# kasih"). Cache the agent's action keyed on the normalized text plus a
+# coarse cart fingerprint, in memory (LRU + TTL) with a write-through
+# sqlite file so the cache survives restarts. Lookups only touch memory;
+# the sqlite write of put() runs in a worker thread.
+
+CACHE_MAX = 5000
+CACHE_TTL = 6 * 3600  # seconds
+
+# Actions that point at specific cart lines can't be reused across carts
+UNCACHEABLE_INTENTS = ("cancel_item",)
+
+
+def cart_fingerprint(cart_state):
+    if not cart_state:
+        return "empty"
+    return f"items:{len(cart_state)}"
+
+
+class AgentCache:
+    def __init__(self, path, max_size=CACHE_MAX, ttl=CACHE_TTL):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (created_at, action)
+        self.conn = None
+        self._db_lock = threading.Lock()  # the connection is used from worker threads
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._avg_miss_latency = 0.0
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS agent_cache (
+                key        TEXT PRIMARY KEY,
+                action     TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        cutoff = time.time() - self.ttl
+        with self.conn:
+            self.conn.execute("DELETE FROM agent_cache WHERE created_at < ?", (cutoff,))
+        rows = self.conn.execute(
+            "SELECT key, action, created_at FROM agent_cache ORDER BY created_at DESC LIMIT ?",
+            (self.max_size,),
+        ).fetchall()
+        for key, action, created_at in reversed(rows):
+            self._entries[key] = (created_at, json.loads(action))
+        print(f"Agent cache: loaded {len(self._entries)} entries")
+
+    def close(self):
+        with self._db_lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    @staticmethod
+    def key(user_message, cart_state):
+        return f"{normalize(user_message)}|{cart_fingerprint(cart_state)}"
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.time() - self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += self._avg_miss_latency
+        return dict(entry[1])
+
+    async def put(self, key, action, latency):
+        """
+        latency: how long the agent call took, used to estimate time saved.
+        """
+        # exponential moving average of a real agent round trip
+        if self._avg_miss_latency:
+            self._avg_miss_latency = 0.9 * self._avg_miss_latency + 0.1 * latency
+        else:
+            self._avg_miss_latency = latency
+
+        if action.get("intent") in UNCACHEABLE_INTENTS:
+            return
+        now = time.time()
+        self._entries[key] = (now, dict(action))
+        self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > self.max_size:
+            old_key, _ = self._entries.popitem(last=False)
+            evicted.append(old_key)
+        if self.conn is not None:
+            row = (key, json.dumps(action, ensure_ascii=False), now)
+            await asyncio.to_thread(self._persist, row, evicted)
+
+    def _persist(self, row, evicted):
+        with self._db_lock:
+            if self.conn is None:
+                return
+            with self.conn:
+                self.conn.executemany(
+                    "DELETE FROM agent_cache WHERE key = ?", [(k,) for k in evicted]
+                )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO agent_cache (key, action, created_at) VALUES (?, ?, ?)",
+                    row,
+                )
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+            "saved_latency_s": round(self.saved_seconds, 2),
+            "avg_agent_latency_ms": round(self._avg_miss_latency * 1000, 1),
+        }
@@ -0,0 +1,178 @@
+import time
+import random
+import asyncio
+from collections import deque
+
+import httpx
+
+# -----------------------------
+# Guarded OpenAI client
+# -----------------------------
+# Bounds what a slow / failing OpenAI can do to the webhook workers:
+#   - a semaphore caps concurrent completions
+#   - every call has an overall deadline (queueing + retries included)
+#   - transient failures (timeouts, 429, 5xx) retry with jittered backoff
+#   - a circuit breaker stops calling OpenAI while its error rate or p95
+#     latency is over threshold; callers fall back to local parsing.
+
+
+class AIUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        window=50,
+        min_calls=10,
+        max_error_rate=0.5,
+        max_p95=8.0,
+        cooldown=30.0,
+    ):
+        self.min_calls = min_calls
+        self.max_error_rate = max_error_rate
+        self.max_p95 = max_p95
+        self.cooldown = cooldown
+        self._results = deque(maxlen=window)  # (ok, latency seconds)
+        self.state = "closed"  # closed | open | half_open
+        self.opened_at = 0.0
+        self.trips = 0
+
+    def allow(self):
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            # let one probe through
+            self.state = "half_open"
+            return True
+        return False
+
+    def record(self, ok, latency):
+        self._results.append((ok, latency))
+        if self.state == "half_open":
+            if ok and latency < self.max_p95:
+                self.state = "closed"
+                self._results.clear()
+            else:
+                self._trip()
+            return
+        if self.state == "closed" and len(self._results) >= self.min_calls:
+            if self.error_rate() > self.max_error_rate or self.p95() > self.max_p95:
+                self._trip()
+
+    def _trip(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        print(
+            f"AI circuit OPEN (error_rate={self.error_rate():.2f}, p95={self.p95():.2f}s)"
+        )
+
+    def error_rate(self):
+        if not self._results:
+            return 0.0
+        return sum(1 for ok, _ in self._results if not ok) / len(self._results)
+
+    def p95(self):
+        if not self._results:
+            return 0.0
+        latencies = sorted(lat for _, lat in self._results)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "trips": self.trips,
+            "error_rate": round(self.error_rate(), 3),
+            "p95_ms": round(self.p95() * 1000, 1),
+        }
+
+
+class AIClient:
+    def __init__(
+        self,
+        http,
+        max_concurrency=8,
+        deadline=12.0,
+        attempt_timeout=8.0,
+        retries=2,
+        backoff=0.3,
+        breaker=None,
+    ):
+        """
+        http: UpstreamClient for the OpenAI API
+        """
+        self.http = http
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.fallbacks = 0
+
+    async def complete(self, body):
+        """
+        POST /chat/completions and return the message content.
+        Raises AIUnavailable when the breaker is open, the deadline passes
+        or all retries fail.
+        """
+        if not self.breaker.allow():
+            self.fallbacks += 1
+            raise AIUnavailable("circuit open")
+        try:
+            return await asyncio.wait_for(self._complete(body), self.deadline)
+        except asyncio.TimeoutError:
+            self.fallbacks += 1
+            self.breaker.record(False, self.deadline)
+            raise AIUnavailable("deadline exceeded")
+        except AIUnavailable:
+            self.fallbacks += 1
+            raise
+
+    async def _complete(self, body):
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            # also when wait_for cancels us while still queued
+            self.waiting -= 1
+        try:
+            last_error = None
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    # full jitter: 0..backoff*2^attempt
+                    await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                started = time.monotonic()
+                try:
+                    res = await self.http.post(
+                        "/chat/completions", json=body, timeout=self.attempt_timeout
+                    )
+                except httpx.HTTPError as e:
+                    self.breaker.record(False, time.monotonic() - started)
+                    last_error = e
+                    continue
+
+                latency = time.monotonic() - started
+                if res.status_code == 429 or res.status_code >= 500:
+                    self.breaker.record(False, latency)
+                    last_error = f"HTTP {res.status_code}"
+                    continue
+
+                self.breaker.record(res.status_code < 400, latency)
+                if res.status_code >= 400:
+                    # 4xx other than 429 won't get better by retrying
+                    raise AIUnavailable(f"HTTP {res.status_code}: {res.text[:200]}")
+                return res.json()["choices"][0]["message"]["content"]
+
+            raise AIUnavailable(f"retries exhausted: {last_error}")
+        finally:
+            self._sem.release()
+
+    def stats(self):
+        return {
+            "waiting": self.waiting,
+            "fallbacks": self.fallbacks,
+            "breaker": self.breaker.stats(),
+        }
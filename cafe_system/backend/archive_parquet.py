@@ -0,0 +1,140 @@
+import os
+import sys
+from datetime import date, datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only needed for the Parquet history
+    pa = pq = None
+
+from order_archive import OrderArchive, archive_key
+
+# -----------------------------
+# Columnar (Parquet) copy of the order archive
+# -----------------------------
+# The JSONL archive is the source of truth (the backend appends to it and
+# looks customers' past orders up in it). For analysis over months of
+# history the dashboard reads this compacted copy instead: one Parquet
+# file per closed day, one row per order line,
+#
+#   archive/parquet/date=YYYY-MM-DD/orders.parquet
+#
+# amounts as int64, timestamps as timestamp[ns] and the repeated strings
+# (order id, user, table, status, item, category) dictionary-encoded.
+# Partitions are dated by the day orders closed, like the JSONL files;
+# readers pick days by directory name (partition pruning, see
+# dashboard/utils/data_loaders for the opening-date rule) and read only
+# the columns they need (column projection).
+#
+# Only finished days are compacted: a day's JSONL never changes after
+# that day. A partition is rewritten when its JSONL is newer than it, and
+# records the JSONL size it was built from ("source_bytes" in the schema
+# metadata), so a reader can pick up anything appended after it from the
+# JSONL itself.
+#
+# Run from cron / by hand:  python archive_parquet.py [--all]
+
+PARQUET_DIR = "parquet"
+PARTITION_FILE = "orders.parquet"
+
+DICTIONARY = ["order_id", "user", "table", "status", "item", "category"]
+INTEGER = ["qty", "price", "subtotal"]
+TIMESTAMP = ["timestamp", "closed_at"]
+COLUMNS = ["order_id", "user", "table", "status", "timestamp", "closed_at",
+           "item", "qty", "price", "subtotal", "category"]
+
+
+def schema():
+    fields = []
+    for name in COLUMNS:
+        if name in DICTIONARY:
+            fields.append(pa.field(name, pa.dictionary(pa.int32(), pa.string())))
+        elif name in INTEGER:
+            fields.append(pa.field(name, pa.int64()))
+        elif name in TIMESTAMP:
+            fields.append(pa.field(name, pa.timestamp("ns")))
+    return pa.schema(fields)
+
+
+def partition_path(archive_root, day):
+    return os.path.join(archive_root, PARQUET_DIR, f"date={day}", PARTITION_FILE)
+
+
+def _timestamp(value):
+    try:
+        return datetime.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _columns(records):
+    columns = {name: [] for name in COLUMNS}
+    for record in records:
+        order_id = archive_key(record["user"], record)
+        timestamp = _timestamp(record.get("timestamp"))
+        closed_at = _timestamp(record.get("closed_at"))
+        for item in record.get("order", []):
+            columns["order_id"].append(order_id)
+            columns["user"].append(record["user"])
+            columns["table"].append(record.get("table") or "N/A")
+            columns["status"].append(record.get("status"))
+            columns["timestamp"].append(timestamp)
+            columns["closed_at"].append(closed_at)
+            columns["item"].append(item["name"])
+            columns["qty"].append(int(item["qty"]))
+            columns["price"].append(int(item["price"]))
+            columns["subtotal"].append(int(item["subtotal"]))
+            columns["category"].append(item.get("category") or "Uncategorized")
+    return columns
+
+
+def compact_day(archive, day):
+    """
+    Write one day's partition. Returns the number of order lines written.
+    """
+    source = archive.path_for(day)
+    source_bytes = os.path.getsize(source)
+    records = [r for r in archive.read(day) if isinstance(r, dict) and "user" in r]
+    table = pa.Table.from_pydict(_columns(records), schema=schema())
+    table = table.replace_schema_metadata({"source_bytes": str(source_bytes)})
+
+    path = partition_path(archive.root, day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, path)  # readers never see a half-written file
+    return table.num_rows
+
+
+def is_stale(archive, day):
+    path = partition_path(archive.root, day)
+    if not os.path.exists(path):
+        return True
+    return os.path.getmtime(archive.path_for(day)) > os.path.getmtime(path)
+
+
+def compact(archive, today=None, everything=False):
+    """
+    Compact every finished day that has no (or an outdated) partition.
+    everything=True rewrites all of them. Returns {day: rows}.
+    """
+    if pq is None:
+        raise RuntimeError("pyarrow is not installed (pip install pyarrow)")
+    today = str(today or date.today())
+    done = {}
+    for day in archive.days():
+        if day >= today:
+            continue  # still being appended to
+        if everything or is_stale(archive, day):
+            done[day] = compact_day(archive, day)
+    return done
+
+
+if __name__ == "__main__":
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    root = os.getenv("ORDERS_ARCHIVE_DIR", os.path.join(base_dir, "archive"))
+    done = compact(OrderArchive(root), everything="--all" in sys.argv)
+    for day, rows in done.items():
+        print(f"Parquet: {day} -> {rows} order lines")
+    print(f"Parquet: compacted {len(done)} day(s) into {os.path.join(root, PARQUET_DIR)}")
@@ -0,0 +1,149 @@
+# -----------------------------
+# Compact cart representation
+# -----------------------------
+# Cart lines are keyed by product_retailer_id (the menu code), so merging
+# an incoming catalog item into an existing line is an O(1) dict lookup
+# instead of a scan by display name. Lines keep their insertion order,
+# which is the 1-based numbering customers use with "hapus <no> <qty>".
+#
+# Serialized as the existing orders_log.json list shape:
+#   [{"code", "name", "qty", "price", "subtotal", "category"?}, ...]
+# Legacy lines without a code are keyed by name.
+#
+# Amounts are int minor units (see money.py). The cart keeps its total
+# up to date in O(1) on every change instead of re-summing the lines.
+
+from money import maybe_check, to_minor
+
+
+class CartLine:
+    __slots__ = ("code", "name", "qty", "price", "subtotal", "category")
+
+    def __init__(self, code, name, qty, price, category=None):
+        self.code = code
+        self.name = name
+        self.qty = int(qty)
+        self.price = to_minor(price)
+        self.subtotal = self.qty * self.price
+        self.category = category
+
+    def to_dict(self):
+        data = {
+            "code": self.code,
+            "name": self.name,
+            "qty": self.qty,
+            "price": self.price,
+            "subtotal": self.subtotal,
+        }
+        if self.category:
+            data["category"] = self.category
+        return data
+
+
+class Cart:
+    __slots__ = ("_lines", "_index", "total")
+
+    def __init__(self):
+        self._lines = []  # CartLine, in display order
+        self._index = {}  # code -> CartLine
+        self.total = 0
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __iter__(self):
+        return iter(self._lines)
+
+    def __bool__(self):
+        return bool(self._lines)
+
+    @staticmethod
+    def key_of(item):
+        return str(item.get("code") or item["name"])
+
+    def get(self, code):
+        return self._index.get(code)
+
+    def line_at(self, index):
+        """
+        0-based display position -> CartLine, or None if out of range.
+        """
+        if 0 <= index < len(self._lines):
+            return self._lines[index]
+        return None
+
+    def add(self, code, name, qty, price, category=None):
+        """
+        Merge qty into the line for `code` (new lines go to the end).
+        """
+        line = self._index.get(code)
+        if line is None:
+            line = CartLine(code, name, qty, price, category)
+            self._lines.append(line)
+            self._index[code] = line
+            amount = line.subtotal
+        else:
+            # merged at the line's price, so subtotal == qty * price holds
+            qty = int(qty)
+            amount = qty * line.price
+            line.qty += qty
+            line.subtotal += amount
+        self.total += amount
+        maybe_check(self)
+        return line
+
+    def remove_at(self, index, qty):
+        """
+        Take `qty` off the line at `index`; the line is dropped when it
+        reaches zero. Returns the amount removed from the cart's value.
+        """
+        line = self._lines[index]
+        if qty >= line.qty:
+            del self._lines[index]
+            del self._index[line.code]
+            amount = line.subtotal
+        else:
+            amount = qty * line.price
+            line.qty -= qty
+            line.subtotal -= amount
+        self.total -= amount
+        maybe_check(self)
+        return amount
+
+    def to_list(self):
+        return [line.to_dict() for line in self._lines]
+
+    @classmethod
+    def from_list(cls, items):
+        cart = cls()
+        for item in items:
+            # Old name-keyed data may hold duplicates; add() folds them
+            # together. Subtotals / totals are recomputed from qty x price.
+            cart.add(
+                cls.key_of(item),
+                item["name"],
+                item["qty"],
+                item["price"],
+                item.get("category"),
+            )
+        return cart
+
+
+def order_from_json(order):
+    """
+    Turn a stored order (with "order" as a list) into its in-memory form.
+    """
+    if not isinstance(order.get("order"), Cart):
+        order["order"] = Cart.from_list(order.get("order", []))
+        order["total"] = order["order"].total
+    return order
+
+
+def json_default(obj):
+    """
+    json.dump(default=...) hook so orders holding a Cart serialize to the
+    plain list shape.
+    """
+    if isinstance(obj, Cart):
+        return obj.to_list()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+
+# -----------------------------
+# Seen WhatsApp message ids
+# -----------------------------
+# Meta redelivers a webhook when we're slow. Remembering recently seen
+# msg["id"]s lets a redelivery short-circuit before any parsing, AI call
+# or store write. Bounded by size (LRU) and age (TTL).
+
+SEEN_MAX = 20000
+SEEN_TTL = 24 * 3600  # seconds; Meta stops retrying well before this
+
+
+class SeenMessages:
+    def __init__(self, max_size=SEEN_MAX, ttl=SEEN_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._seen = OrderedDict()  # msg_id -> seen_at (epoch seconds)
+        self.duplicates = 0
+
+    def load(self, entries):
+        """
+        entries: iterable of (msg_id, seen_at), oldest first
+        """
+        cutoff = time.time() - self.ttl
+        for msg_id, seen_at in entries:
+            if seen_at >= cutoff:
+                self._seen[msg_id] = seen_at
+        self._evict()
+
+    def check(self, msg_id):
+        """
+        True if msg_id was already seen (and not expired).
+        """
+        seen_at = self._seen.get(msg_id)
+        if seen_at is None:
+            return False
+        if seen_at < time.time() - self.ttl:
+            del self._seen[msg_id]
+            return False
+        self._seen.move_to_end(msg_id)
+        self.duplicates += 1
+        return True
+
+    def add(self, msg_id, seen_at=None):
+        self._seen[msg_id] = seen_at or time.time()
+        self._seen.move_to_end(msg_id)
+        self._evict()
+
+    def _evict(self):
+        cutoff = time.time() - self.ttl
+        # Oldest entries sit at the front: drop expired ones, then trim to size
+        while self._seen:
+            msg_id, seen_at = next(iter(self._seen.items()))
+            if seen_at >= cutoff and len(self._seen) <= self.max_size:
+                break
+            self._seen.popitem(last=False)
+
+    def stats(self):
+        return {"size": len(self._seen), "duplicates": self.duplicates}
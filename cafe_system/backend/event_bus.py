@@ -0,0 +1,111 @@
+import time
+import asyncio
+from collections import deque
+
+# -----------------------------
+# In-process pub/sub for order events
+# -----------------------------
+# OrderStore publishes one event per order change; /stream/orders relays
+# them to kitchen screens / dashboards over SSE. Recent events are kept in
+# a ring buffer so a client reconnecting with Last-Event-ID gets exactly
+# what it missed. Event ids are "<boot>-<seq>": after a restart (new boot)
+# or when the client is further behind than the buffer, it gets a fresh
+# snapshot instead.
+#
+# Publishing never blocks: a subscriber whose queue is full is cut off and
+# simply reconnects / resumes from its last id.
+
+HISTORY = 1000  # events kept for resume
+QUEUE_SIZE = 500  # per subscriber
+HEARTBEAT = 15.0  # seconds between keep-alives on an idle stream
+
+
+class EventBus:
+    def __init__(self, history=HISTORY, queue_size=QUEUE_SIZE):
+        self.boot = f"{int(time.time()):x}"
+        self.seq = 0
+        self.history = deque(maxlen=history)  # (seq, kind, data)
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+
+    def event_id(self, seq):
+        return f"{self.boot}-{seq}"
+
+    def publish(self, kind, data):
+        self.seq += 1
+        event = (self.seq, kind, data)
+        self.history.append(event)
+        self.published += 1
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too slow: end its stream, it resumes from its last id
+                self.subscribers.discard(queue)
+                self.dropped += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def _resume_point(self, last_id):
+        """
+        seq to resume after, or None if the client needs a snapshot.
+        """
+        if not last_id:
+            return None
+        boot, _, seq = str(last_id).rpartition("-")
+        if boot != self.boot or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if seq > self.seq:
+            return None
+        oldest = self.history[0][0] if self.history else self.seq + 1
+        if seq < oldest - 1:
+            return None
+        return seq
+
+    async def subscribe(self, last_id=None, snapshot=None, heartbeat=HEARTBEAT):
+        """
+        Async iterator of (seq, kind, data); (None, None, None) is a
+        heartbeat. Starts with ("snapshot", snapshot()) when there's no
+        usable last_id and a snapshot callable is given.
+        """
+        queue = asyncio.Queue(self.queue_size)
+        # Registering, reading the backlog and taking the snapshot happen
+        # without an await in between, so no event can fall in a gap.
+        self.subscribers.add(queue)
+        try:
+            sent = self._resume_point(last_id)
+            if sent is None:
+                sent = self.seq
+                backlog = [(sent, "snapshot", snapshot())] if snapshot else []
+            else:
+                backlog = [e for e in self.history if e[0] > sent]
+
+            for event in backlog:
+                sent = max(sent, event[0])
+                yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None, None, None
+                    continue
+                if event is None:
+                    return
+                if event[0] <= sent:
+                    continue
+                sent = event[0]
+                yield event
+        finally:
+            self.subscribers.discard(queue)
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "dropped_subscribers": self.dropped,
+            "last_id": self.event_id(self.seq),
+        }
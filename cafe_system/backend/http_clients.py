@@ -0,0 +1,102 @@
+import time
+import importlib.util
+
+import httpx
+
+# -----------------------------
+# Shared upstream HTTP clients
+# -----------------------------
+# One long-lived AsyncClient per upstream (Graph API, OpenAI) so messages
+# reuse pooled keep-alive connections instead of paying a TCP + TLS
+# handshake on every send. Created / closed by the FastAPI lifespan.
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class UpstreamClient:
+    def __init__(
+        self,
+        name,
+        base_url="",
+        headers=None,
+        max_connections=20,
+        max_keepalive=10,
+        keepalive_expiry=60.0,
+        connect_timeout=5.0,
+        read_timeout=10.0,
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.headers = headers or {}
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=read_timeout,
+            # waiting for a free pooled connection
+            pool=connect_timeout,
+        )
+        self.client = None
+
+        # Pool-usage metrics
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=HTTP2_AVAILABLE,
+        )
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def post(self, url, **kwargs):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            return await self.client.post(url, **kwargs)
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.requests += 1
+            self.total_latency += time.perf_counter() - started
+
+    def _pool_connections(self):
+        # httpx doesn't expose pool state publicly; read it defensively.
+        try:
+            pool = self.client._transport._pool
+            conns = list(pool.connections)
+        except Exception:
+            return None
+        idle = sum(1 for c in conns if c.is_idle())
+        return {"open": len(conns), "idle": idle, "active": len(conns) - idle}
+
+    def stats(self):
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "max_connections": self.limits.max_connections,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_latency_ms": round(self.total_latency / self.requests * 1000, 1)
+            if self.requests
+            else 0,
+            "pool": self._pool_connections() if self.client else None,
+        }
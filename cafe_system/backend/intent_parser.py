@@ -0,0 +1,185 @@
+import re
+import difflib
+from collections import Counter
+
+# -----------------------------
+# Fast-path intent parser
+# -----------------------------
+# Trivial commands ("menu", "cart", "bayar", "hapus 1 2", "batal", ...)
+# are fixed patterns in the agent's own system prompt. Classify them
+# locally and only fall back to the OpenAI agent when unsure.
+# Returns the same action dict as ask_agent().
+
+FAST_PATH_MIN_CONFIDENCE = 0.85
+MAX_FAST_PATH_WORDS = 4  # longer messages are free text -> agent
+
+TABLE_KEYWORDS = ("table", "meja")
+TABLE_RE = re.compile(r"\d+")
+CANCEL_RE = re.compile(
+    r"^(?:hapus|delete|remove|del|kurangi|cancel|batal|batalkan)\s+(\d+)(?:\s+(\d+))?$"
+)
+ID_CANCEL_WORDS = ("hapus", "kurangi", "batal")  # also matches "batalkan"
+
+# Destructive: only ever taken on an exact phrase, never on a typo match
+# ("cancel 2" is one edit away from "cancel").
+EXACT_ONLY_INTENTS = ("cancel_all",)
+DESTRUCTIVE_INTENTS = ("cancel_all", "cancel_item")
+
+# phrase -> (intent, language)
+PHRASES = {
+    # show_menu
+    "menu": ("show_menu", "id"),
+    "lihat menu": ("show_menu", "id"),
+    "daftar menu": ("show_menu", "id"),
+    "minta menu": ("show_menu", "id"),
+    "katalog": ("show_menu", "id"),
+    "menu please": ("show_menu", "en"),
+    "show menu": ("show_menu", "en"),
+    "see menu": ("show_menu", "en"),
+    "catalog": ("show_menu", "en"),
+    # show_cart
+    "cart": ("show_cart", "id"),
+    "keranjang": ("show_cart", "id"),
+    "lihat keranjang": ("show_cart", "id"),
+    "pesanan saya": ("show_cart", "id"),
+    "lihat pesanan": ("show_cart", "id"),
+    "my cart": ("show_cart", "en"),
+    "my order": ("show_cart", "en"),
+    "show cart": ("show_cart", "en"),
+    # pay
+    "bayar": ("pay", "id"),
+    "bayar sekarang": ("pay", "id"),
+    "mau bayar": ("pay", "id"),
+    "pay": ("pay", "en"),
+    "pay now": ("pay", "en"),
+    "checkout": ("pay", "en"),
+    # cancel_all
+    "batal": ("cancel_all", "id"),
+    "batalkan": ("cancel_all", "id"),
+    "batal semua": ("cancel_all", "id"),
+    "batalkan pesanan": ("cancel_all", "id"),
+    "cancel": ("cancel_all", "en"),
+    "cancel all": ("cancel_all", "en"),
+    "cancel order": ("cancel_all", "en"),
+    # help
+    "bantuan": ("help", "id"),
+    "tolong": ("help", "id"),
+    "help": ("help", "en"),
+}
+
+REPLIES = {
+    "show_menu": {
+        "id": "Siap! Ini menu kami 😊",
+        "en": "Sure! Here is our menu 😊",
+    },
+    "show_cart": {"id": "", "en": ""},
+    "pay": {
+        "id": "Oke, lanjut ke pembayaran ya 😊",
+        "en": "Alright, let's proceed to payment 😊",
+    },
+    "cancel_all": {"id": "", "en": ""},
+    "cancel_item": {"id": "", "en": ""},
+    "help": {
+        "id": "Ketik *menu* untuk lihat menu, *cart* untuk lihat pesanan, "
+        "*hapus <nomor_item> <jumlah>* untuk menghapus item, atau *bayar* untuk membayar 😊",
+        "en": "Type *menu* to see the menu, *cart* to see your order, "
+        "*delete <item_no> <qty>* to remove an item, or *pay* to check out 😊",
+    },
+}
+
+FUZZY_PHRASES = [p for p, (intent, _) in PHRASES.items() if intent not in EXACT_ONLY_INTENTS]
+
+# fast-path hits per intent, "llm" for agent fallbacks
+stats = Counter()
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def normalize(text):
+    text = _PUNCT_RE.sub(" ", text.lower())
+    return " ".join(text.split())
+
+
+def parse_table(text):
+    """
+    "meja 5" / "table 12" -> "5" / "12", else None.
+    """
+    text = text.lower()
+    if any(k in text for k in TABLE_KEYWORDS):
+        match = TABLE_RE.search(text)
+        if match:
+            return match.group(0)
+    return None
+
+
+def _action(intent, lang, cancel_index=None, cancel_qty=None):
+    return {
+        "intent": intent,
+        "cancel_index": cancel_index,
+        "cancel_qty": cancel_qty,
+        "reply": REPLIES[intent][lang],
+    }
+
+
+def parse_intent(text):
+    """
+    Returns (action, confidence). action is None if nothing matched.
+    """
+    norm = normalize(text)
+    if not norm:
+        return None, 0.0
+
+    match = CANCEL_RE.match(norm)
+    if match:
+        lang = "id" if norm.startswith(ID_CANCEL_WORDS) else "en"
+        qty = int(match.group(2)) if match.group(2) else None
+        return _action("cancel_item", lang, int(match.group(1)), qty), 1.0
+
+    if len(norm.split()) > MAX_FAST_PATH_WORDS:
+        return None, 0.0
+
+    if norm in PHRASES:
+        intent, lang = PHRASES[norm]
+        return _action(intent, lang), 1.0
+
+    # Typos: "mneu", "bayr", "keranjng". Text with digits is a command
+    # with arguments, not a typo of a bare phrase.
+    if any(c.isdigit() for c in norm):
+        return None, 0.0
+    close = difflib.get_close_matches(norm, FUZZY_PHRASES, n=1, cutoff=0.75)
+    if close:
+        intent, lang = PHRASES[close[0]]
+        score = difflib.SequenceMatcher(None, norm, close[0]).ratio()
+        return _action(intent, lang), score
+
+    return None, 0.0
+
+
+def fast_intent(text):
+    """
+    The action if we're confident enough to skip the agent, else None.
+    """
+    action, confidence = parse_intent(text)
+    if action is None or confidence < FAST_PATH_MIN_CONFIDENCE:
+        return None
+    record_fast_path(action["intent"])
+    return action
+
+
+def record_fast_path(intent):
+    stats[intent] += 1
+
+
+def record_llm_call():
+    stats["llm"] += 1
+
+
+def hit_rate_stats():
+    fast = sum(v for k, v in stats.items() if k != "llm")
+    total = fast + stats["llm"]
+    return {
+        "fast_path": fast,
+        "llm": stats["llm"],
+        "hit_rate": round(fast / total, 3) if total else 0,
+        "by_intent": {k: v for k, v in stats.items() if k != "llm"},
+    }
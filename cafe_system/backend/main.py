@@ -1,11 +1,38 @@
 import os
+import hmac
 import json
-import httpx
-from fastapi import FastAPI, Request
-from fastapi.responses import PlainTextResponse
+import time
+from collections import Counter
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
-from datetime import datetime
-import re
+
+from order_journal import OrderJournal
+from order_db import SqliteOrderBackend
+from order_store import OrderStore
+from order_archive import OrderArchive
+from event_bus import EventBus
+from order_lifecycle import OPEN, PAID, PREPARING, SERVED, SUBMITTED, status_of
+from http_clients import UpstreamClient
+from message_queue import MessageQueue
+from payload import iter_payload
+from outbound import Outbox, SendQueue
+from money import format_amount, to_minor
+from menu_index import MenuIndex
+from order_parser import MAX_QTY, parse_order_text
+from agent_cache import AgentCache
+from ai_client import AIClient, AIUnavailable, CircuitBreaker
+from intent_parser import (
+    DESTRUCTIVE_INTENTS,
+    FAST_PATH_MIN_CONFIDENCE,
+    fast_intent,
+    hit_rate_stats,
+    parse_intent,
+    parse_table,
+    record_fast_path,
+    record_llm_call,
+)
 
 # -----------------------------
 # Load environment variables
@@ -17,131 +44,210 @@ PHONE_ID = os.getenv("WABA_PHONE_ID")
 VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN")
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 
-GRAPH_URL = f"https://graph.facebook.com/v19.0/{PHONE_ID}/messages"
-ORDERS_FILE = "orders_log.json"
-MENU_FILE = "menu.json"
+# Point GRAPH_URL at mock_graph.py to exercise the send path offline
+GRAPH_URL = os.getenv(
+    "GRAPH_URL", f"https://graph.facebook.com/v19.0/{PHONE_ID}/messages"
+)
+OPENAI_URL = "https://api.openai.com/v1"
+
+# Data files live next to this module, whatever the working directory is
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ORDERS_FILE = os.path.join(BASE_DIR, "orders_log.json")
+JOURNAL_FILE = os.path.join(BASE_DIR, "orders_journal.jsonl")
+SNAPSHOT_FILE = os.path.join(BASE_DIR, "orders_snapshot.json")
+ARCHIVE_DIR = os.getenv("ORDERS_ARCHIVE_DIR", os.path.join(BASE_DIR, "archive"))
+ORDERS_DB = os.getenv("ORDERS_DB", os.path.join(BASE_DIR, "orders.db"))
+ORDERS_BACKEND = os.getenv("ORDERS_BACKEND", "journal")  # "journal" | "sqlite"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_DEPTH = int(os.getenv("WEBHOOK_QUEUE_DEPTH", "1000"))
+MENU_FILE = os.path.join(BASE_DIR, "menu.json")
+AGENT_CACHE_FILE = os.path.join(BASE_DIR, "agent_cache.db")
+OUTBOX_DB = os.path.join(BASE_DIR, "outbox.db")
+SEND_RATE = float(os.getenv("WA_SEND_RATE", "50"))  # messages / second
+SEND_BURST = int(os.getenv("WA_SEND_BURST", "20"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_DEADLINE = float(os.getenv("AI_DEADLINE", "12"))  # seconds per ask_agent
+AI_MAX_P95 = float(os.getenv("AI_MAX_P95", "8"))  # seconds before the breaker opens
+STAFF_TOKEN = os.getenv("STAFF_TOKEN")  # kitchen / cashier / customer endpoints are off without it
 
-app = FastAPI()
+# -----------------------------
+# Shared HTTP clients (one pool per upstream)
+# -----------------------------
+graph_http = UpstreamClient(
+    "graph",
+    headers={
+        "Authorization": f"Bearer {ACCESS_TOKEN}",
+        "Content-Type": "application/json",
+    },
+    max_connections=20,
+    max_keepalive=10,
+    read_timeout=10.0,
+)
+openai_http = UpstreamClient(
+    "openai",
+    base_url=OPENAI_URL,
+    headers={
+        "Authorization": f"Bearer {OPENAI_KEY}",
+        "Content-Type": "application/json",
+    },
+    max_connections=10,
+    max_keepalive=5,
+    read_timeout=30.0,
+)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    store.open()
+    await store.start()
+    agent_cache.open()
+    await graph_http.start()
+    await openai_http.start()
+    send_queue.open()
+    await send_queue.start()
+    await queue.start()
+    yield
+    await queue.stop()
+    await send_queue.stop()
+    await graph_http.close()
+    await openai_http.close()
+    agent_cache.close()
+    await store.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # -----------------------------
-# Load menu.json (code -> name)
+# Menu index (reloaded when menu.json changes)
 # -----------------------------
-if os.path.exists(MENU_FILE):
-    with open(MENU_FILE, "r", encoding="utf-8") as f:
-        MENU = json.load(f)
-else:
-    MENU = {}
+menu = MenuIndex(MENU_FILE)
+menu.load()
 
 
 # -----------------------------
 # Orders helpers
 # -----------------------------
-def load_orders():
-    if not os.path.exists(ORDERS_FILE):
-        return {}
-    try:
-        with open(ORDERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}
+# Carts live in memory in the OrderStore (per-customer locks); every change
+# is persisted by the backend:
+#   journal: append-only log, orders_log.json refreshed on compaction
+#   sqlite:  orders / order_items tables in WAL mode (one row per visit),
+#            orders_log.json refreshed by the store's periodic flush
+# Closed orders go to the dated archive (archive/orders-YYYY-MM-DD.jsonl).
+archive = OrderArchive(ARCHIVE_DIR)
+if ORDERS_BACKEND == "sqlite":
+    backend = SqliteOrderBackend(
+        ORDERS_DB, import_path=ORDERS_FILE, archive=archive, export_path=ORDERS_FILE
+    )
+else:
+    backend = OrderJournal(
+        JOURNAL_FILE, SNAPSHOT_FILE, export_path=ORDERS_FILE, archive=archive
+    )
+# Order changes are pushed to /stream/orders subscribers
+bus = EventBus()
+store = OrderStore(backend, archive=archive, bus=bus)
 
 
-def save_orders(orders):
-    with open(ORDERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(orders, f, indent=4, ensure_ascii=False)
+async def update_order(user_id, items, table=None):
+    """
+    items: list of {code, name, qty, price, subtotal}
+    An order already past "open" is archived and the items start a new
+    visit (see OrderStore.add_items).
+    """
+    return await store.add_items(user_id, items, table)
 
 
-def update_order(user_id, items, table=None):
+async def cancel_all_orders(user_id):
+    return await store.clear(user_id)
+
+
+def menu_line(item, qty):
     """
-    items: list of {name, qty, price, subtotal}
+    MenuItem + qty -> item dict for update_order()
     """
-    orders = load_orders()
-    if user_id not in orders:
-        orders[user_id] = {
-            "order": [],
-            "total": 0,
-            "status": "unpaid",
-            "timestamp": str(datetime.now()),
-            "table": table or None,
-        }
+    price = to_minor(item.price)
+    return {
+        "code": item.id,
+        "name": item.name,
+        "qty": qty,
+        "price": price,
+        "subtotal": price * qty,
+        "category": item.category,
+    }
 
-    if table and not orders[user_id].get("table"):
-        orders[user_id]["table"] = table
 
-    for item in items:
-        existing = next(
-            (x for x in orders[user_id]["order"] if x["name"] == item["name"]), None
-        )
-        if existing:
-            existing["qty"] += item["qty"]
-            existing["subtotal"] += item["qty"] * item["price"]
-        else:
-            orders[user_id]["order"].append(item)
+# Customer-facing wording for each lifecycle step
+STATUS_TEXT = {
+    SUBMITTED: "sudah diteruskan ke dapur",
+    PREPARING: "sedang disiapkan",
+    SERVED: "sudah diantar",
+    PAID: "sudah dibayar",
+}
+STATUS_UPDATES = {
+    PREPARING: "👨‍🍳 Pesanan kamu sedang disiapkan.",
+    SERVED: "🍽️ Pesanan kamu sudah diantar. Selamat menikmati!",
+    PAID: "✅ Pembayaran diterima. Terima kasih sudah mampir 😊",
+}
 
-        orders[user_id]["total"] += item["qty"] * item["price"]
 
-    save_orders(orders)
-    return orders[user_id]
+def locked_message(to, order):
+    """
+    Reply when the customer tries to change an order that's past "open".
+    """
+    state = STATUS_TEXT.get(status_of(order), "sedang diproses") if order else "sedang diproses"
+    return {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": "text",
+        "text": {
+            "body": f"🔒 Pesanan kamu {state}, jadi sudah tidak bisa diubah lagi. "
+            "Silakan hubungi kasir kalau ada perubahan ya 😊"
+        },
+    }
 
 
-def cancel_all_orders(user_id):
-    orders = load_orders()
-    if user_id in orders:
-        del orders[user_id]
-        save_orders(orders)
-        return True
-    return False
+def status_message(to, order):
+    """
+    Where an already-submitted order is, for "bayar" / "Bayar Sekarang".
+    """
+    body = f"🧾 Pesanan kamu {STATUS_TEXT.get(status_of(order), 'sedang diproses')}."
+    if order.get("payment_method"):
+        body += f"\nMetode pembayaran: {order['payment_method']}, silakan selesaikan di kasir ya 😊"
+    return {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": "text",
+        "text": {"body": body},
+    }
 
 
 def build_cart_text(order_obj):
     """
     Build numbered cart lines from an order object like:
-    { "order": [...], "total": ... }
+    { "order": Cart, "total": ... }
     """
     lines = []
-    for idx, item in enumerate(order_obj["order"], start=1):
-        lines.append(
-            f"{idx}. {item['name']} x{item['qty']} = {item['subtotal']:,} IDR"
-        )
+    for idx, line in enumerate(order_obj["order"], start=1):
+        lines.append(f"{idx}. {line.name} x{line.qty} = {format_amount(line.subtotal)}")
     text = "🧾 Pesanan kamu:\n" + "\n".join(lines)
-    text += f"\n\nTotal: {order_obj['total']:,} IDR"
+    text += f"\n\nTotal: {format_amount(order_obj['total'])}"
     text += "\nUntuk membatalkan, ketik *hapus <nomor_item> <jumlah>*.\nContoh: `hapus 1 2`"
     return text
 
 
-def get_cart_state_for_agent(user_id):
-    orders = load_orders()
-    user_order = orders.get(user_id)
-    if not user_order:
-        return []
-    result = []
-    for idx, item in enumerate(user_order["order"], start=1):
-        result.append(
-            {
-                "index": idx,
-                "name": item["name"],
-                "qty": item["qty"],
-                "subtotal": item["subtotal"],
-            }
-        )
-    return result
-
-
 # -----------------------------
 # WhatsApp helpers
 # -----------------------------
 async def wa_send(payload):
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    async with httpx.AsyncClient() as client:
-        res = await client.post(GRAPH_URL, headers=headers, json=payload)
-        print("WA STATUS:", res.status_code)
-        try:
-            print(res.json())
-        except Exception:
-            print(await res.text())
+    """
+    One Graph API call. Retries / throttling are handled by send_queue.
+    """
+    res = await graph_http.post(GRAPH_URL, json=payload)
+    if res.status_code >= 300:
+        print("WA STATUS:", res.status_code, res.text[:500])
+    return res
+
+
+send_queue = SendQueue(wa_send, OUTBOX_DB, rate=SEND_RATE, burst=SEND_BURST)
 
 
 def catalog_message(to):
@@ -165,7 +271,7 @@ def payment_options(to, total):
         "interactive": {
             "type": "button",
             "body": {
-                "text": f"💰 Total pesanan kamu {total:,} IDR.\nPilih metode pembayaran:"
+                "text": f"💰 Total pesanan kamu {format_amount(total)}.\nPilih metode pembayaran:"
             },
             "action": {
                 "buttons": [
@@ -181,6 +287,17 @@ def payment_options(to, total):
     }
 
 
+# button id -> (payment_method, reply)
+PAYMENT_METHODS = {
+    "PAY_QRIS": ("QRIS", "📸 Silakan scan QRIS di kasir atau yang sudah kami sediakan ya."),
+    "PAY_CASH": ("CASH", "💵 Baik, silakan bayar tunai di kasir saat pesanan diantar atau diambil."),
+    "PAY_VA": (
+        "VA",
+        "🏦 Pembayaran via Virtual Account akan diinformasikan oleh kasir. Terima kasih 😊",
+    ),
+}
+
+
 def ask_next_action(to):
     """
     Show next action buttons after user has an updated cart (typically after ordering).
@@ -215,6 +332,34 @@ def ask_next_action(to):
 # -----------------------------
 # AI Agent: interpret text → intent
 # -----------------------------
+agent_cache = AgentCache(AGENT_CACHE_FILE)
+ai = AIClient(
+    openai_http,
+    max_concurrency=AI_MAX_CONCURRENCY,
+    deadline=AI_DEADLINE,
+    breaker=CircuitBreaker(max_error_rate=0.5, max_p95=AI_MAX_P95),
+)
+
+
+def local_fallback(user_message):
+    """
+    Used when there is no OPENAI_KEY or the AI circuit is open: take the
+    local parser's best guess even at low confidence, else a generic hint.
+    Destructive intents still need the fast-path confidence.
+    """
+    action, confidence = parse_intent(user_message)
+    if action is not None and not (
+        action["intent"] in DESTRUCTIVE_INTENTS and confidence < FAST_PATH_MIN_CONFIDENCE
+    ):
+        return action
+    return {
+        "intent": "none",
+        "cancel_index": None,
+        "cancel_qty": None,
+        "reply": "Ketik *menu* untuk lihat menu, atau *cart* untuk lihat pesananmu 😊",
+    }
+
+
 async def ask_agent(user_message: str, cart_state: list):
     """
     Call OpenAI agent to parse text into JSON:
@@ -225,17 +370,19 @@ async def ask_agent(user_message: str, cart_state: list):
       "reply": "friendly text"
     }
 
-    NOTE: for 'add_item' we DO NOT directly modify cart.
-    We just respond & show catalog so the user can tap items.
+    NOTE: for 'add_item' the agent's reply is only a confirmation; the
+    backend adds the items it can match on the menu (order_parser) and
+    shows the catalog for anything it couldn't.
     """
     if not OPENAI_KEY:
         # fallback if key missing
-        return {
-            "intent": "none",
-            "cancel_index": None,
-            "cancel_qty": None,
-            "reply": "Ketik *menu* untuk lihat menu, atau *cart* untuk lihat pesananmu 😊",
-        }
+        return local_fallback(user_message)
+
+    # Same phrasing + same cart shape -> reuse the earlier answer
+    cache_key = agent_cache.key(user_message, cart_state)
+    cached = agent_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     system_message = """
 You are a multilingual AI assistant for a restaurant WhatsApp ordering bot.
@@ -273,7 +420,7 @@ SUPPORTED INTENTS
 - "cancel_all" → user wants to remove all items  
 - "pay" → user wants to proceed to payment  
 - "add_item" → user mentions food items in free text (e.g., “lasagne 2”, “I want tea 1”)  
-               NOTE: you DO NOT modify cart; just confirm and backend will open catalog.
+               NOTE: you DO NOT modify cart; the backend adds the items it recognizes.
 - "help" → user confused  
 - "none" → smalltalk, greetings, unclear  
 
@@ -292,14 +439,16 @@ ADD_ITEM BEHAVIOR (IMPORTANT)
 ----------------------------------------------
 For "add_item" intent:
 - You DO NOT guess price or real item code.
-- You DO NOT change the cart.
-- You simply confirm nicely what the user wants and tell them the catalogue will appear.
+- You DO NOT change the cart yourself.
+- You simply confirm nicely what the user wants. The backend then adds the
+  items it recognizes and sends the updated cart (and the catalog for
+  anything it couldn't find), so do not promise a catalog or list prices.
 
 ID example:
-“Baik! Kamu ingin Lasagne 2 dan Tea 1 ya. Silakan pilih itemnya dari katalog di bawah 😊”
+“Baik! Kamu ingin Lasagne 2 dan Tea 1 ya, aku proses dulu 😊”
 
 EN example:
-“Great! You want 2 Lasagne and 1 Tea. Please select the items from the catalog below 😊”
+“Great! You want 2 Lasagne and 1 Tea, let me add that for you 😊”
 
 ----------------------------------------------
 TONE GUIDELINES
@@ -321,14 +470,11 @@ No explanation, no markdown, no text around it.
         "current_cart": cart_state,
     }
 
-    async with httpx.AsyncClient() as client:
-        res = await client.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENAI_KEY}",
-                "Content-Type": "application/json",
-            },
-            json={
+    started = time.perf_counter()
+    ok = False
+    try:
+        content = await ai.complete(
+            {
                 "model": "gpt-4o-mini",
                 "messages": [
                     {"role": "system", "content": system_message},
@@ -339,12 +485,16 @@ No explanation, no markdown, no text around it.
                 ],
                 "response_format": {"type": "json_object"},
                 "temperature": 0.3,
-            },
+            }
         )
-
-    try:
-        content = res.json()["choices"][0]["message"]["content"]
         action = json.loads(content)
+        if not isinstance(action, dict):
+            raise ValueError("agent returned non-object JSON")
+        ok = True
+    except AIUnavailable as e:
+        # OpenAI slow / failing / circuit open: stay responsive locally
+        print("Agent unavailable:", e)
+        return local_fallback(user_message)
     except Exception as e:
         print("Agent error:", e)
         action = {
@@ -363,6 +513,8 @@ No explanation, no markdown, no text around it.
     if "reply" not in action:
         action["reply"] = ""
 
+    if ok:
+        await agent_cache.put(cache_key, action, time.perf_counter() - started)
     return action
 
 
@@ -376,20 +528,313 @@ async def verify(hub_mode: str = None, hub_challenge: str = None, hub_verify_tok
     return PlainTextResponse("Verification failed", status_code=403)
 
 
+# -----------------------------
+# Metrics
+# -----------------------------
+delivery_statuses = Counter()
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "http": {"graph": graph_http.stats(), "openai": openai_http.stats()},
+        "queue": queue.stats(),
+        "outbound": send_queue.stats(),
+        "dedup": store.seen.stats(),
+        "delivery_statuses": dict(delivery_statuses),
+        "intents": hit_rate_stats(),
+        "agent_cache": agent_cache.stats(),
+        "ai": ai.stats(),
+        "menu": menu.stats(),
+        "stream": bus.stats(),
+        "orders": {
+            "live": len(store.orders),
+            "kitchen_queue": len(store.kitchen_queue()),
+            "archived": archive.archived,
+            "swept": store.swept,
+        },
+    }
+
+
+# -----------------------------
+# Kitchen / cashier
+# -----------------------------
+# Staff move orders along the lifecycle (preparing -> served -> paid);
+# the customer gets a WhatsApp update at each step.
+def staff_denied(token):
+    # Fail closed: these endpoints expose phone numbers and can mark orders
+    # paid, so they stay off until STAFF_TOKEN is configured.
+    if not STAFF_TOKEN:
+        return JSONResponse({"error": "staff endpoints disabled (STAFF_TOKEN not set)"}, status_code=403)
+    if not token or not hmac.compare_digest(str(token).encode(), STAFF_TOKEN.encode()):
+        return JSONResponse({"error": "forbidden"}, status_code=403)
+    return None
+
+
+@app.get("/kitchen")
+async def kitchen(x_staff_token: str = Header(None)):
+    denied = staff_denied(x_staff_token)
+    if denied:
+        return denied
+    return [
+        {
+            "order_id": view["order_id"],
+            "user": view["user"],
+            "table": view["table"],
+            "status": view["status"],
+            "submitted_at": view["timeline"].get(SUBMITTED),
+            "items": [{"name": item["name"], "qty": item["qty"]} for item in view["items"]],
+        }
+        for view in store.kitchen_queue()
+    ]
+
+
+@app.post("/orders/{order_id}/status")
+async def set_order_status(order_id: str, request: Request, x_staff_token: str = Header(None)):
+    denied = staff_denied(x_staff_token)
+    if denied:
+        return denied
+    status = (await request.json()).get("status")
+    if status not in STATUS_UPDATES:
+        return JSONResponse(
+            {"error": f"status must be one of {sorted(STATUS_UPDATES)}"}, status_code=400
+        )
+    found = store.find(order_id)
+    if found is None:
+        return JSONResponse({"error": "no live order with that id"}, status_code=404)
+    user_id, current = found
+    order = await store.advance(user_id, status, order_id)
+    if order is None:
+        return JSONResponse(
+            {"error": f"can't go from {status_of(current)} to {status}"}, status_code=409
+        )
+
+    await send_queue.enqueue(
+        [
+            {
+                "messaging_product": "whatsapp",
+                "to": user_id,
+                "type": "text",
+                "text": {"body": STATUS_UPDATES[status]},
+            }
+        ]
+    )
+    return {"order_id": order_id, "user": user_id, "status": status_of(order)}
+
+
+@app.get("/stream/orders")
+async def stream_orders(
+    request: Request,
+    token: str = None,
+    last_event_id: str = Header(None),
+    x_staff_token: str = Header(None),
+):
+    """
+    Server-Sent Events feed of order changes for kitchen screens / the
+    dashboard. Starts with a "snapshot" of the live orders, then sends
+    "order.updated" / "order.removed". Browsers' EventSource reconnects
+    with Last-Event-ID and resumes where it left off (EventSource can't
+    set headers, so the staff token may also be passed as ?token=).
+    """
+    denied = staff_denied(x_staff_token or token)
+    if denied:
+        return denied
+    resume = last_event_id or request.query_params.get("last_event_id")
+
+    async def events():
+        yield "retry: 2000\n\n"
+        async with aclosing(bus.subscribe(resume, snapshot=store.snapshot)) as stream:
+            async for seq, kind, data in stream:
+                if await request.is_disconnected():
+                    break
+                if seq is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                payload = json.dumps(data, ensure_ascii=False)
+                yield f"id: {bus.event_id(seq)}\nevent: {kind}\ndata: {payload}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/customers/{user_id}/orders")
+async def customer_orders(user_id: str, x_staff_token: str = Header(None)):
+    """
+    The customer's active visit and past (archived) visits.
+    """
+    denied = staff_denied(x_staff_token)
+    if denied:
+        return denied
+    active = store.orders.get(user_id)
+    return {
+        "active": {"order_id": active["id"], "status": status_of(active)} if active else None,
+        "past": [{"order_id": oid, "day": day} for oid, day in store.past_orders(user_id)],
+    }
+
+
 # -----------------------------
 # Main webhook
 # -----------------------------
+# Validate + enqueue only; the workers run handle_message().
 @app.post("/webhook")
 async def webhook(request: Request):
     data = await request.json()
     print("INCOMING:", data)
 
-    try:
-        msg = data["entry"][0]["changes"][0]["value"]["messages"][0]
-        from_no = msg["from"]
-        msg_type = msg.get("type")
-    except Exception:
+    accepted = []  # (from_no, msg_id) to mark as seen in one store write
+    batch_ids = set()
+    busy = False
+    for kind, item in iter_payload(data):
+        if kind == "status":
+            record_status(item)
+            continue
+
+        try:
+            from_no = item["from"]
+            msg_id = item["id"]
+        except Exception:
+            continue
+
+        # Meta redelivery of a message we already accepted
+        if msg_id in batch_ids or store.is_duplicate(msg_id):
+            continue
+
+        if not queue.submit(from_no, item):
+            busy = True
+            continue
+        batch_ids.add(msg_id)
+        accepted.append((from_no, msg_id))
+
+    await store.mark_seen_many(accepted)
+
+    if busy:
+        # Shed load: a non-2xx makes Meta redeliver the payload once we've
+        # caught up; the messages already accepted are dropped as duplicates.
+        return JSONResponse({"status": "busy"}, status_code=503)
+    if not accepted:
         return {"status": "ignored"}
+    return {"status": "queued", "messages": len(accepted)}
+
+
+def record_status(status):
+    """
+    Delivery receipts (sent / delivered / read / failed) for our outbound
+    messages. Anything not shaped like a receipt is skipped.
+    """
+    if not isinstance(status, dict):
+        return
+    state = status.get("status")
+    delivery_statuses[state if isinstance(state, str) else "unknown"] += 1
+    if status.get("status") == "failed":
+        print("WA DELIVERY FAILED:", status.get("recipient_id"), status.get("errors"))
+
+
+async def handle_message(msg):
+    """
+    One customer turn: handle the message, then hand every reply it
+    produced to the send queue in one go.
+    """
+    out = Outbox()
+    try:
+        await handle_turn(msg, out)
+    finally:
+        await send_queue.enqueue(out.messages)
+
+
+async def add_parsed_items(from_no, parsed, out):
+    """
+    Add the items resolved from a free-text order, ask about ambiguous
+    names and impossible quantities, and send the catalog for names that
+    matched nothing. Returns True if the items were handled (added or
+    asked about), False if the catalog should take over.
+    """
+    priced = [(item, qty) for item, qty in parsed.lines if item.price is not None]
+    unpriced = [item for item, qty in parsed.lines if item.price is None]
+
+    current = None
+    if priced:
+        current = await update_order(from_no, [menu_line(item, qty) for item, qty in priced])
+        added = ", ".join(f"{item.name} x{qty}" for item, qty in priced)
+        out.send(
+            {
+                "messaging_product": "whatsapp",
+                "to": from_no,
+                "type": "text",
+                "text": {"body": f"✅ Ditambahkan: {added}\n\n" + build_cart_text(current)},
+            }
+        )
+
+    if parsed.ambiguous:
+        options = []
+        for phrase, candidates, qty in parsed.ambiguous:
+            names = " / ".join(f"*{item.name}*" for item in candidates)
+            options.append(f"• {phrase}: {names}")
+        example = parsed.ambiguous[0]
+        out.send(
+            {
+                "messaging_product": "whatsapp",
+                "to": from_no,
+                "type": "text",
+                "text": {
+                    "body": "🤔 Maksud kamu yang mana?\n"
+                    + "\n".join(options)
+                    + f"\n\nTulis lagi nama lengkapnya ya, contoh: `{example[1][0].name} {example[2]}`"
+                },
+            }
+        )
+
+    if parsed.bad_qty:
+        asks = ", ".join(f"*{name}* {qty}" for name, qty in parsed.bad_qty)
+        out.send(
+            {
+                "messaging_product": "whatsapp",
+                "to": from_no,
+                "type": "text",
+                "text": {
+                    "body": f"❓ Jumlah {asks} sepertinya kurang pas. "
+                    f"Mau pesan berapa? (1–{MAX_QTY} per item)"
+                },
+            }
+        )
+
+    if unpriced:
+        names = ", ".join(item.name for item in unpriced)
+        out.send(
+            {
+                "messaging_product": "whatsapp",
+                "to": from_no,
+                "type": "text",
+                "text": {"body": f"{names} bisa dipilih langsung dari katalog ya 😊"},
+            }
+        )
+
+    handled = current is not None or bool(parsed.bad_qty)
+    if parsed.unknown and handled:
+        # only when something else was handled; otherwise the caller sends the catalog
+        names = ", ".join(f"*{phrase}*" for phrase in parsed.unknown)
+        out.send(
+            {
+                "messaging_product": "whatsapp",
+                "to": from_no,
+                "type": "text",
+                "text": {"body": f"🔍 {names} tidak ada di menu, coba pilih dari katalog ya 😊"},
+            }
+        )
+
+    if unpriced or (parsed.unknown and handled):
+        out.send(catalog_message(from_no))
+
+    if current:
+        out.send(ask_next_action(from_no))
+    return handled or bool(unpriced)
+
+
+async def handle_turn(msg, out):
+    from_no = msg["from"]
+    msg_type = msg.get("type")
 
     # -----------------------------
     # 1. Handle WhatsApp 'order' (catalog-based)
@@ -401,113 +846,111 @@ async def webhook(request: Request):
         new_items = []
         for p in products:
             code = str(p["product_retailer_id"])
-            qty = p["quantity"]
-            price = p.get("item_price", 0)
-            name = MENU.get(code, code)
+            qty = int(p["quantity"])
+            price = to_minor(p.get("item_price", 0))
+            item = menu.get(code)
 
             new_items.append(
                 {
-                    "name": name,
+                    "code": code,
+                    "name": item.name if item else code,
                     "qty": qty,
                     "price": price,
                     "subtotal": price * qty,
+                    "category": item.category if item else None,
                 }
             )
 
-        current = update_order(from_no, new_items)
+        current = await update_order(from_no, new_items)
 
         summary = "\n".join(
             [
-                f"{idx}. {i['name']} x{i['qty']} = {i['subtotal']:,} IDR"
-                for idx, i in enumerate(current["order"], start=1)
+                f"{idx}. {line.name} x{line.qty} = {format_amount(line.subtotal)}"
+                for idx, line in enumerate(current["order"], start=1)
             ]
         )
 
         # Send summary
-        await wa_send(
+        out.send(
             {
                 "messaging_product": "whatsapp",
                 "to": from_no,
                 "type": "text",
                 "text": {
-                    "body": f"🧾 Pesanan kamu:\n{summary}\n\nTotal: {current['total']:,} IDR"
+                    "body": f"🧾 Pesanan kamu:\n{summary}\n\nTotal: {format_amount(current['total'])}"
                 },
             }
         )
 
         # Then show what to do next
-        await wa_send(ask_next_action(from_no))
-        return {"status": "ok"}
+        out.send(ask_next_action(from_no))
+        return
 
     # -----------------------------
     # 2. Handle text (AI-driven)
     # -----------------------------
     if msg_type == "text":
         raw_text = msg["text"]["body"]
-        text = raw_text.lower()
 
         # Quick rule: detect table number before AI
-        if any(k in text for k in ["table", "meja"]):
-            match = re.search(r"\d+", text)
-            if match:
-                table_no = match.group(0)
-                orders = load_orders()
-                if from_no not in orders:
-                    orders[from_no] = {
-                        "order": [],
-                        "total": 0,
-                        "status": "unpaid",
-                        "timestamp": str(datetime.now()),
-                        "table": table_no,
-                    }
-                else:
-                    orders[from_no]["table"] = table_no
-                save_orders(orders)
-
-                await wa_send(
-                    {
-                        "messaging_product": "whatsapp",
-                        "to": from_no,
-                        "type": "text",
-                        "text": {
-                            "body": f"👋 Hai! Kamu duduk di meja {table_no}. "
-                                    "Kamu bisa ketik *menu* untuk lihat menu, atau langsung tulis mau pesan apa 😊"
-                        },
-                    }
-                )
-                return {"status": "ok"}
-
-        # Build cart state for the agent
-        cart_state = get_cart_state_for_agent(from_no)
+        table_no = parse_table(raw_text)
+        if table_no:
+            await store.set_table(from_no, table_no)
 
-        # Ask the AI agent
-        action = await ask_agent(raw_text, cart_state)
+            out.send(
+                {
+                    "messaging_product": "whatsapp",
+                    "to": from_no,
+                    "type": "text",
+                    "text": {
+                        "body": f"👋 Hai! Kamu duduk di meja {table_no}. "
+                                "Kamu bisa ketik *menu* untuk lihat menu, atau langsung tulis mau pesan apa 😊"
+                    },
+                }
+            )
+            return
+
+        # Fixed commands (menu / cart / bayar / hapus 1 2 ...) are parsed
+        # locally; only free text goes to the AI agent.
+        action = fast_intent(raw_text)
+        parsed = None
+        if action is None:
+            # "lasagne 2 dan teh 1" -> straight into the cart
+            parsed = parse_order_text(raw_text, menu)
+            if parsed.is_order():
+                record_fast_path("add_item")
+                await add_parsed_items(from_no, parsed, out)
+                return
+            record_llm_call()
+            cart_state = await store.cart_state(from_no)
+            action = await ask_agent(raw_text, cart_state)
         intent = action["intent"]
         cancel_index = action["cancel_index"]
         cancel_qty = action["cancel_qty"]
         reply = action["reply"] or ""
 
-        # Always send the AI reply first
-        await wa_send(
-            {
-                "messaging_product": "whatsapp",
-                "to": from_no,
-                "type": "text",
-                "text": {"body": reply},
-            }
-        )
+        # Always send the AI reply first (fast-path actions may have none)
+        if reply:
+            out.send(
+                {
+                    "messaging_product": "whatsapp",
+                    "to": from_no,
+                    "type": "text",
+                    "text": {"body": reply},
+                }
+            )
 
         # --- INTENT: show_menu ---
         if intent == "show_menu":
-            await wa_send(catalog_message(from_no))
-            return {"status": "ok"}
+            out.send(catalog_message(from_no))
+            return
 
         # --- INTENT: show_cart ---
         if intent == "show_cart":
-            orders = load_orders()
-            if from_no in orders and orders[from_no]["order"]:
-                cart_text = build_cart_text(orders[from_no])
-                await wa_send(
+            current = await store.get(from_no)
+            if current and current["order"]:
+                cart_text = build_cart_text(current)
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -515,9 +958,9 @@ async def webhook(request: Request):
                         "text": {"body": cart_text},
                     }
                 )
-                await wa_send(ask_next_action(from_no))
+                out.send(ask_next_action(from_no))
             else:
-                await wa_send(
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -527,12 +970,12 @@ async def webhook(request: Request):
                         },
                     }
                 )
-            return {"status": "ok"}
+            return
 
         # --- INTENT: cancel_all ---
         if intent == "cancel_all":
-            if cancel_all_orders(from_no):
-                await wa_send(
+            if await cancel_all_orders(from_no):
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -540,8 +983,10 @@ async def webhook(request: Request):
                         "text": {"body": "❌ Semua pesanan kamu sudah aku batalkan."},
                     }
                 )
+            elif current := await store.get(from_no):
+                out.send(locked_message(from_no, current))
             else:
-                await wa_send(
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -549,13 +994,13 @@ async def webhook(request: Request):
                         "text": {"body": "Sepertinya belum ada pesanan yang aktif."},
                     }
                 )
-            return {"status": "ok"}
+            return
 
         # --- INTENT: cancel_item ---
         if intent == "cancel_item":
-            orders = load_orders()
-            if from_no not in orders or not orders[from_no]["order"]:
-                await wa_send(
+            current = await store.get(from_no)
+            if not current or not current["order"]:
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -565,10 +1010,14 @@ async def webhook(request: Request):
                         },
                     }
                 )
-                return {"status": "ok"}
+                return
+
+            if status_of(current) != OPEN:
+                out.send(locked_message(from_no, current))
+                return
 
             if cancel_index is None:
-                await wa_send(
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -578,12 +1027,13 @@ async def webhook(request: Request):
                         },
                     }
                 )
-                return {"status": "ok"}
+                return
 
-            index = int(cancel_index) - 1
-            user_order = orders[from_no]["order"]
-            if index < 0 or index >= len(user_order):
-                await wa_send(
+            # If cancel_qty == -1 or None -> remove all
+            qty = None if cancel_qty is None else int(cancel_qty)
+            removed = await store.remove(from_no, int(cancel_index) - 1, qty)
+            if removed is None:
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -591,33 +1041,17 @@ async def webhook(request: Request):
                         "text": {"body": "Nomor itemnya belum tepat, coba cek lagi ya 😊"},
                     }
                 )
-                return {"status": "ok"}
+                return
 
-            item = user_order[index]
-
-            # If cancel_qty == -1 or None -> remove all
-            if cancel_qty is None or int(cancel_qty) <= 0:
-                qty_to_remove = item["qty"]
-            else:
-                qty_to_remove = int(cancel_qty)
-
-            if qty_to_remove >= item["qty"]:
-                # remove whole
-                orders[from_no]["total"] -= item["subtotal"]
-                user_order.remove(item)
+            item, qty_removed, current = removed
+            if qty_removed >= item["qty"]:
                 msg2 = f"🗑️ Semua '{item['name']}' sudah aku hapus."
             else:
-                reduce_amount = qty_to_remove * item["price"]
-                item["qty"] -= qty_to_remove
-                item["subtotal"] -= reduce_amount
-                orders[from_no]["total"] -= reduce_amount
-                msg2 = f"🗑️ '{item['name']}' aku kurangi {qty_to_remove}."
-
-            # Save and respond with updated cart / empty info
-            if not user_order:
-                del orders[from_no]
-                save_orders(orders)
-                await wa_send(
+                msg2 = f"🗑️ '{item['name']}' aku kurangi {qty_removed}."
+
+            # Respond with updated cart / empty info
+            if not current:
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -628,9 +1062,8 @@ async def webhook(request: Request):
                     }
                 )
             else:
-                save_orders(orders)
-                cart_text = build_cart_text(orders[from_no])
-                await wa_send(
+                cart_text = build_cart_text(current)
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -638,16 +1071,16 @@ async def webhook(request: Request):
                         "text": {"body": msg2 + "\n\n" + cart_text},
                     }
                 )
-                await wa_send(ask_next_action(from_no))
+                out.send(ask_next_action(from_no))
 
-            return {"status": "ok"}
+            return
 
         # --- INTENT: pay ---
         if intent == "pay":
-            orders = load_orders()
-            total = orders.get(from_no, {}).get("total", 0)
+            current = await store.get(from_no)
+            total = current["total"] if current else 0
             if total <= 0:
-                await wa_send(
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -657,21 +1090,26 @@ async def webhook(request: Request):
                         },
                     }
                 )
-                return {"status": "ok"}
+                return
+
+            if status_of(current) != OPEN:
+                out.send(status_message(from_no, current))
+                return
 
-            await wa_send(payment_options(from_no, total))
-            return {"status": "ok"}
+            out.send(payment_options(from_no, total))
+            return
 
         # --- INTENT: add_item (free-text ordering UX) ---
         if intent == "add_item":
-            # We already sent AI confirmation text above.
-            # Now show catalog so user can tap items to actually add to cart.
-            await wa_send(catalog_message(from_no))
-            return {"status": "ok"}
+            # We already sent AI confirmation text above. Add whatever
+            # resolved locally; the catalog covers the rest.
+            if not parsed or not await add_parsed_items(from_no, parsed, out):
+                out.send(catalog_message(from_no))
+            return
 
         # --- INTENT: help or none ---
         # Already sent AI reply text, nothing more to do.
-        return {"status": "ok"}
+        return
 
     # -----------------------------
     # 3. INTERACTIVE BUTTON HANDLER
@@ -682,15 +1120,18 @@ async def webhook(request: Request):
 
         # Next-action buttons
         if reply_id == "ORDER_MORE":
-            await wa_send(catalog_message(from_no))
-            return {"status": "ok"}
+            out.send(catalog_message(from_no))
+            return
 
         if reply_id == "ORDER_CANCEL":
-            if cancel_all_orders(from_no):
+            if await cancel_all_orders(from_no):
                 body = "❌ Semua pesanan kamu sudah aku batalkan."
+            elif current := await store.get(from_no):
+                out.send(locked_message(from_no, current))
+                return
             else:
                 body = "Belum ada pesanan aktif yang bisa dibatalkan."
-            await wa_send(
+            out.send(
                 {
                     "messaging_product": "whatsapp",
                     "to": from_no,
@@ -698,13 +1139,13 @@ async def webhook(request: Request):
                     "text": {"body": body},
                 }
             )
-            return {"status": "ok"}
+            return
 
         if reply_id == "PAY_NOW":
-            orders = load_orders()
-            total = orders.get(from_no, {}).get("total", 0)
+            current = await store.get(from_no)
+            total = current["total"] if current else 0
             if total <= 0:
-                await wa_send(
+                out.send(
                     {
                         "messaging_product": "whatsapp",
                         "to": from_no,
@@ -714,48 +1155,49 @@ async def webhook(request: Request):
                         },
                     }
                 )
+            elif status_of(current) != OPEN:
+                out.send(status_message(from_no, current))
             else:
-                await wa_send(payment_options(from_no, total))
-            return {"status": "ok"}
-
-        # Payment method buttons (very simple stubs)
-        if reply_id == "PAY_QRIS":
-            await wa_send(
-                {
-                    "messaging_product": "whatsapp",
-                    "to": from_no,
-                    "type": "text",
-                    "text": {
-                        "body": "📸 Silakan scan QRIS di kasir atau yang sudah kami sediakan ya."
-                    },
-                }
-            )
-            return {"status": "ok"}
-
-        if reply_id == "PAY_CASH":
-            await wa_send(
+                out.send(payment_options(from_no, total))
+            return
+
+        # Payment method buttons: the order goes to the kitchen
+        if reply_id in PAYMENT_METHODS:
+            method, body = PAYMENT_METHODS[reply_id]
+            current = await store.submit(from_no, method)
+            if current is None:
+                current = await store.get(from_no)
+                if current and current["order"]:
+                    out.send(status_message(from_no, current))
+                else:
+                    out.send(
+                        {
+                            "messaging_product": "whatsapp",
+                            "to": from_no,
+                            "type": "text",
+                            "text": {
+                                "body": "Belum ada pesanan yang bisa dibayar. Ketik *menu* untuk mulai."
+                            },
+                        }
+                    )
+                return
+            out.send(
                 {
                     "messaging_product": "whatsapp",
                     "to": from_no,
                     "type": "text",
                     "text": {
-                        "body": "💵 Baik, silakan bayar tunai di kasir saat pesanan diantar atau diambil."
+                        "body": body
+                        + f"\n\n👨‍🍳 Pesanan #{current['id']} sudah diteruskan ke dapur."
                     },
                 }
             )
-            return {"status": "ok"}
+            return
 
-        if reply_id == "PAY_VA":
-            await wa_send(
-                {
-                    "messaging_product": "whatsapp",
-                    "to": from_no,
-                    "type": "text",
-                    "text": {
-                        "body": "🏦 Pembayaran via Virtual Account akan diinformasikan oleh kasir. Terima kasih 😊"
-                    },
-                }
-            )
-            return {"status": "ok"}
 
-    return {"status": "ok"}
+# -----------------------------
+# Inbound worker queue (started by the lifespan)
+# -----------------------------
+queue = MessageQueue(
+    handle_message, workers=WEBHOOK_WORKERS, max_depth=WEBHOOK_QUEUE_DEPTH
+)
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+
+from intent_parser import normalize
+
+# -----------------------------
+# Menu index
+# -----------------------------
+# menu.json maps product_retailer_id -> item. Both formats are accepted:
+#   "5": "Lasagne"
+#   "5": {"name": "Lasagne", "category": "Mains", "price": 9000, "aliases": ["lasagna"]}
+# The index is rebuilt whenever the file's mtime changes, so menu edits
+# take effect without restarting the server.
+
+RELOAD_CHECK_INTERVAL = 1.0  # seconds between mtime checks
+
+# match_phrase() thresholds (trigram Jaccard similarity)
+FUZZY_ACCEPT = 0.55  # best candidate must score at least this...
+FUZZY_MARGIN = 0.15  # ...and beat the runner-up by this much
+FUZZY_SUGGEST = 0.3  # candidates worth offering when ambiguous
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+class MenuItem:
+    __slots__ = (
+        "id",
+        "name",
+        "category",
+        "price",
+        "aliases",
+        "phrases",
+        "tokens",
+        "grams",
+    )
+
+    def __init__(self, id, name, category=None, price=None, aliases=()):
+        self.id = id
+        self.name = name
+        self.category = category
+        self.price = price
+        self.aliases = list(aliases)
+        # normalized token set of the name and of every alias
+        self.phrases = [frozenset(normalize(p).split()) for p in [name, *self.aliases]]
+        self.tokens = frozenset().union(*self.phrases)
+        # trigram set of the name and of every alias (typo-tolerant matching)
+        self.grams = [trigrams(normalize(p)) for p in [name, *self.aliases]]
+
+
+class MenuIndex:
+    def __init__(self, path):
+        self.path = path
+        self.items = {}  # id -> MenuItem
+        self.by_phrase = {}  # normalized name / alias -> id
+        self.by_token = {}  # normalized token -> set of ids
+        self.by_trigram = {}  # trigram -> set of ids
+        self.mtime = None
+        self.reloads = 0
+        self._checked_at = 0.0
+
+    def load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            print(f"Menu: {self.path} not found")
+            self.mtime = None
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except json.JSONDecodeError as e:
+            # Half-written file: keep serving the previous index
+            print("Menu: invalid JSON, keeping previous menu:", e)
+            return
+
+        items = {}
+        by_phrase = {}
+        by_token = {}
+        by_trigram = {}
+        for code, value in raw.items():
+            code = str(code)
+            if isinstance(value, str):
+                value = {"name": value}
+            item = MenuItem(
+                code,
+                value["name"],
+                value.get("category"),
+                value.get("price"),
+                value.get("aliases", []),
+            )
+            items[code] = item
+            for phrase in [item.name, *item.aliases]:
+                by_phrase[normalize(phrase)] = code
+            for token in item.tokens:
+                by_token.setdefault(token, set()).add(code)
+            for gram in frozenset().union(*item.grams):
+                by_trigram.setdefault(gram, set()).add(code)
+
+        self.items, self.by_phrase = items, by_phrase
+        self.by_token, self.by_trigram = by_token, by_trigram
+        self.mtime = mtime
+        self.reloads += 1
+        print(f"Menu: loaded {len(items)} items")
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self.mtime:
+            self.load()
+
+    # -----------------------------
+    # Lookups
+    # -----------------------------
+    def get(self, code):
+        self.maybe_reload()
+        return self.items.get(str(code))
+
+    def name(self, code):
+        item = self.get(code)
+        return item.name if item else str(code)
+
+    def category(self, code):
+        item = self.get(code)
+        return item.category if item else None
+
+    def search(self, text, limit=5):
+        """
+        Token match of free text against names / aliases.
+        Returns [(MenuItem, score)] best first; score is the best share of
+        a name's / alias's tokens present in the text (1.0 = all of them).
+        """
+        self.maybe_reload()
+        norm = normalize(text)
+        if norm in self.by_phrase:
+            return [(self.items[self.by_phrase[norm]], 1.0)]
+
+        words = set(norm.split())
+        candidates = set()
+        for word in words:
+            candidates.update(self.by_token.get(word, ()))
+        scored = []
+        for code in candidates:
+            item = self.items[code]
+            score = max(len(p & words) / len(p) for p in item.phrases if p)
+            scored.append((item, score))
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        return scored[:limit]
+
+    def fuzzy(self, text, limit=5):
+        """
+        Trigram similarity of the whole phrase against names / aliases;
+        tolerates typos ("lasagnia", "paela"). [(MenuItem, score)] best first.
+        """
+        self.maybe_reload()
+        grams = trigrams(normalize(text))
+        candidates = set()
+        for gram in grams:
+            candidates.update(self.by_trigram.get(gram, ()))
+        scored = []
+        for code in candidates:
+            item = self.items[code]
+            score = max(len(g & grams) / len(g | grams) for g in item.grams)
+            scored.append((item, score))
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        return scored[:limit]
+
+    def match_phrase(self, phrase):
+        """
+        Resolve a phrase that should name exactly one item.
+        Returns (item, []) when confident, (None, candidates) when it's
+        ambiguous and (None, []) when nothing looks close.
+        """
+        phrase = normalize(phrase)
+        if not phrase:
+            return None, []
+        self.maybe_reload()
+        if phrase in self.by_phrase:
+            return self.items[self.by_phrase[phrase]], []
+
+        words = set(phrase.split())
+        complete = [item for item, score in self.search(phrase) if score == 1.0]
+        if len(complete) == 1 and complete[0].tokens >= words:
+            return complete[0], []
+
+        scored = self.fuzzy(phrase)
+        if not scored:
+            return None, []
+        best, best_score = scored[0]
+        runner_up = scored[1][1] if len(scored) > 1 else 0.0
+        if best_score >= FUZZY_ACCEPT and best_score - runner_up >= FUZZY_MARGIN:
+            return best, []
+        # Partial token matches ("salad") are good suggestions too
+        suggestions = [item for item, score in scored if score >= FUZZY_SUGGEST]
+        for item, _ in self.search(phrase, limit=3):
+            if item not in suggestions:
+                suggestions.append(item)
+        return None, suggestions[:3]
+
+    def stats(self):
+        return {"items": len(self.items), "reloads": self.reloads}
@@ -0,0 +1,104 @@
+import time
+import zlib
+import asyncio
+
+# -----------------------------
+# Inbound message queue
+# -----------------------------
+# The webhook only validates + enqueues, then returns 200 right away so
+# Meta doesn't retry slow deliveries. A fixed pool of worker tasks does
+# the real work (AI call, store writes, WhatsApp sends).
+#
+# Each customer is hashed onto one lane (one worker per lane), so messages
+# from the same from_no are handled strictly in arrival order while
+# different customers are processed in parallel.
+
+
+class MessageQueue:
+    def __init__(self, handler, workers=8, max_depth=1000):
+        """
+        handler:   async fn(msg) called for every queued message
+        workers:   number of lanes / worker tasks
+        max_depth: total queued messages before submit() starts rejecting
+        """
+        self.handler = handler
+        self.max_depth = max_depth
+        self.lanes = [asyncio.Queue() for _ in range(workers)]
+        self._tasks = []
+
+        # Backpressure metrics
+        self.depth = 0
+        self.peak_depth = 0
+        self.enqueued = 0
+        self.processed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _lane(self, key):
+        return self.lanes[zlib.crc32(key.encode()) % len(self.lanes)]
+
+    def submit(self, key, msg):
+        """
+        Enqueue without waiting. Returns False when the queue is full so
+        the caller can shed load (Meta will redeliver later).
+        """
+        if self.depth >= self.max_depth:
+            self.rejected += 1
+            return False
+        self._lane(key).put_nowait((time.monotonic(), msg))
+        self.depth += 1
+        self.enqueued += 1
+        self.peak_depth = max(self.peak_depth, self.depth)
+        return True
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker(lane)) for lane in self.lanes]
+
+    async def stop(self, timeout=10.0):
+        """
+        Give queued messages a chance to finish, then cancel the workers.
+        """
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(lane.join() for lane in self.lanes)), timeout
+            )
+        except asyncio.TimeoutError:
+            print(f"Queue: stopping with {self.depth} messages unprocessed")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, lane):
+        while True:
+            enqueued_at, msg = await lane.get()
+            self.depth -= 1
+            wait = time.monotonic() - enqueued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            try:
+                await self.handler(msg)
+            except Exception as e:
+                self.errors += 1
+                print("Worker error:", repr(e))
+            finally:
+                self.processed += 1
+                lane.task_done()
+
+    def stats(self):
+        return {
+            "workers": len(self.lanes),
+            "max_depth": self.max_depth,
+            "depth": self.depth,
+            "peak_depth": self.peak_depth,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "avg_wait_ms": round(self.total_wait / self.processed * 1000, 1)
+            if self.processed
+            else 0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+        }
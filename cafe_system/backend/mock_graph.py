@@ -0,0 +1,84 @@
+import os
+import time
+import random
+import asyncio
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# -----------------------------
+# Local mock of the WhatsApp Graph API
+# -----------------------------
+# For testing outbound throughput and retry behaviour offline:
+#
+#   uvicorn mock_graph:app --port 9000
+#   GRAPH_URL=http://localhost:9000/v19.0/PHONE/messages uvicorn main:app
+#
+# Knobs (env):
+#   MOCK_RATE        accepted messages / second before answering 429 (default 80)
+#   MOCK_429_RATE    extra random 429 probability (default 0)
+#   MOCK_5XX_RATE    random 500 / 503 probability (default 0.05)
+#   MOCK_LATENCY_MS  base response latency (default 50, +/- 50% jitter)
+#   MOCK_RETRY_AFTER Retry-After seconds sent with 429s (default 1)
+
+RATE = float(os.getenv("MOCK_RATE", "80"))
+P_429 = float(os.getenv("MOCK_429_RATE", "0"))
+P_5XX = float(os.getenv("MOCK_5XX_RATE", "0.05"))
+LATENCY = float(os.getenv("MOCK_LATENCY_MS", "50")) / 1000
+RETRY_AFTER = os.getenv("MOCK_RETRY_AFTER", "1")
+
+app = FastAPI()
+
+counts = Counter()
+received = {}  # recipient -> list of accepted message bodies, in arrival order
+_window = {"start": time.monotonic(), "count": 0}
+
+
+def _over_rate():
+    now = time.monotonic()
+    if now - _window["start"] >= 1.0:
+        _window["start"] = now
+        _window["count"] = 0
+    _window["count"] += 1
+    return _window["count"] > RATE
+
+
+@app.post("/{version}/{phone_id}/messages")
+async def messages(version: str, phone_id: str, request: Request):
+    payload = await request.json()
+    await asyncio.sleep(LATENCY * random.uniform(0.5, 1.5))
+    counts["requests"] += 1
+
+    if _over_rate() or random.random() < P_429:
+        counts["429"] += 1
+        return JSONResponse(
+            {"error": {"code": 130429, "message": "Rate limit hit"}},
+            status_code=429,
+            headers={"Retry-After": RETRY_AFTER},
+        )
+    if random.random() < P_5XX:
+        status = random.choice([500, 503])
+        counts[str(status)] += 1
+        return JSONResponse({"error": {"message": "Service unavailable"}}, status_code=status)
+
+    counts["200"] += 1
+    body = payload.get("text", {}).get("body") or payload.get("type")
+    received.setdefault(payload.get("to"), []).append(body)
+    return {
+        "messaging_product": "whatsapp",
+        "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+        "messages": [{"id": f"wamid.mock.{counts['200']}"}],
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return {"counts": dict(counts), "received": received}
+
+
+@app.post("/reset")
+async def reset():
+    counts.clear()
+    received.clear()
+    return {"status": "ok"}
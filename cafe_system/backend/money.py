@@ -0,0 +1,76 @@
+import os
+from decimal import Decimal, ROUND_HALF_UP
+
+# -----------------------------
+# Money: integer minor units
+# -----------------------------
+# All amounts in carts are ints in the currency's minor unit, so running
+# totals can't drift the way float += / -= does. IDR has no minor unit in
+# practice (exponent 0), which keeps the stored numbers identical to the
+# rupiah amounts already in orders_log.json.
+
+CURRENCY = "IDR"
+CURRENCY_EXPONENT = 0
+_QUANT = Decimal(1).scaleb(-CURRENCY_EXPONENT)
+
+# Verify cart totals against their lines on every change when set,
+# otherwise every CHECK_EVERY changes.
+MONEY_DEBUG = os.getenv("MONEY_DEBUG", "") not in ("", "0", "false")
+CHECK_EVERY = 200
+
+_ops = 0
+
+
+class TotalsMismatch(AssertionError):
+    pass
+
+
+def to_minor(amount):
+    """
+    int / float / str / Decimal major-unit amount -> int minor units,
+    rounded half-up. Ints (the normal case from the catalog) pass through.
+    """
+    if isinstance(amount, int):
+        return amount * 10**CURRENCY_EXPONENT
+    if amount is None or amount == "":
+        return 0
+    value = Decimal(str(amount)).quantize(_QUANT, rounding=ROUND_HALF_UP)
+    return int(value.scaleb(CURRENCY_EXPONENT))
+
+
+def format_amount(minor):
+    """
+    12500 -> "12,500 IDR"
+    """
+    if CURRENCY_EXPONENT:
+        major = Decimal(minor).scaleb(-CURRENCY_EXPONENT)
+        return f"{major:,.{CURRENCY_EXPONENT}f} {CURRENCY}"
+    return f"{minor:,} {CURRENCY}"
+
+
+def maybe_check(cart):
+    """
+    Called after each cart change; verifies totals in debug mode or
+    periodically. In production a mismatch is logged and repaired.
+    """
+    global _ops
+    _ops += 1
+    if MONEY_DEBUG or _ops % CHECK_EVERY == 0:
+        check_totals(cart, repair=not MONEY_DEBUG)
+
+
+def check_totals(cart, repair=True):
+    expected = 0
+    for line in cart:
+        if line.subtotal != line.qty * line.price:
+            if not repair:
+                raise TotalsMismatch(f"line {line.code}: {line.subtotal} != {line.qty} x {line.price}")
+            print(f"Money: repaired subtotal of {line.code}")
+            line.subtotal = line.qty * line.price
+        expected += line.subtotal
+    if cart.total != expected:
+        if not repair:
+            raise TotalsMismatch(f"cart total {cart.total} != sum of lines {expected}")
+        print(f"Money: repaired cart total {cart.total} -> {expected}")
+        cart.total = expected
+    return True
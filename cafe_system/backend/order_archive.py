@@ -0,0 +1,121 @@
+import os
+import json
+import glob
+import threading
+
+from cart import json_default
+
+# -----------------------------
+# Dated archive of closed orders
+# -----------------------------
+# Closed orders leave the live state (and orders_log.json) and are
+# appended to archive/orders-YYYY-MM-DD.jsonl, one JSON line per order,
+# dated by the day they closed. Files are append-only and a day's file
+# never changes after that day, so readers can index / cache them freely.
+#
+# Line shape: the orders_log.json order ({id, order, total, status,
+# timestamp, table, ...}) plus "user" and "closed_at".
+#
+# The archive also keeps the phone -> past orders index. It is built by
+# one scan of the files on first use and maintained on every append.
+#
+# Appends are idempotent: an order is identified by its id, so
+# re-archiving it after a crash / journal replay is a no-op.
+
+
+def archive_key(user_id, order):
+    # records archived before orders had ids: (user, opening timestamp)
+    return order.get("id") or f"{user_id}@{order.get('timestamp')}"
+
+
+class OrderArchive:
+    def __init__(self, root):
+        self.root = root
+        self._keys = None  # archive keys already written
+        self._by_user = {}  # user_id -> [(order_id, day)], oldest first
+        self._lock = threading.Lock()
+        self.archived = 0
+
+    def path_for(self, day):
+        return os.path.join(self.root, f"orders-{day}.jsonl")
+
+    def days(self):
+        """
+        Archived days, oldest first ("YYYY-MM-DD").
+        """
+        paths = sorted(glob.glob(os.path.join(self.root, "orders-*.jsonl")))
+        return [os.path.basename(p)[len("orders-") : -len(".jsonl")] for p in paths]
+
+    def _load_index(self):
+        if self._keys is not None:
+            return
+        keys = set()
+        by_user = {}
+        for day in self.days():
+            for record in self.read(day):
+                key = archive_key(record["user"], record)
+                keys.add(key)
+                by_user.setdefault(record["user"], []).append((key, day))
+            self._end_torn_line(self.path_for(day))
+        self._keys, self._by_user = keys, by_user
+
+    def orders_of(self, user_id):
+        """
+        [(order_id, day)] of the customer's past orders, oldest first.
+        """
+        with self._lock:
+            self._load_index()
+            return list(self._by_user.get(user_id, ()))
+
+    def find(self, order_id, day):
+        for record in self.read(day):
+            if archive_key(record["user"], record) == order_id:
+                return record
+        return None
+
+    def append(self, user_id, order, closed_at):
+        """
+        closed_at: timestamp string of the close event; its date picks the file.
+        """
+        day = str(closed_at)[:10]
+        key = archive_key(user_id, order)
+        with self._lock:
+            self._load_index()
+            if key in self._keys:
+                return False
+            record = dict(order, user=user_id, closed_at=str(closed_at))
+            line = json.dumps(record, ensure_ascii=False, default=json_default)
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.path_for(day), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._keys.add(key)
+            self._by_user.setdefault(user_id, []).append((key, day))
+            self.archived += 1
+            return True
+
+    @staticmethod
+    def _end_torn_line(path):
+        # so the next append starts on its own line
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        with open(path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    def read(self, day):
+        path = self.path_for(day)
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # torn last line from a crash mid-append
+                    continue
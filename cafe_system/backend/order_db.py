@@ -0,0 +1,387 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+from cart import Cart, order_from_json
+from order_journal import _write_json_atomic, apply_event, archive_legacy, legacy_order_id
+
+# -----------------------------
+# SQLite order backend
+# -----------------------------
+# Drop-in storage backend for OrderStore (same load / append_many / close
+# interface as OrderJournal). Each visit is its own row in `orders`, so a
+# returning customer's new cart no longer overwrites the previous one.
+# Live visits have closed_at NULL. Closed visits (paid, abandoned, expired,
+# handed off) keep their row with the status they reached, closed_at and
+# close_reason, and are also handed to the OrderArchive; the indexes serve
+# queries over that history. Carts the customer cancelled (or emptied)
+# never became sales and are deleted. Orders of a legacy orders_log.json
+# are imported as closed visits.
+#
+# The database runs in WAL mode: the dashboard reads the live visits with
+# its own read-only connection (connect(readonly=True), mirrored in
+# dashboard/utils/data_loaders) while the webhook writes, without either
+# blocking the other. flush() still rewrites orders_log.json
+# (export_path) for dashboards without the database.
+
+SEEN_LIMIT = 20000  # seen message ids returned by load_seen()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_ref      TEXT,  -- the visit's order id (OrderStore "id")
+    user           TEXT NOT NULL,
+    table_no       TEXT,
+    status         TEXT NOT NULL,
+    total          INTEGER NOT NULL DEFAULT 0,
+    payment_method TEXT,
+    timestamp      TEXT NOT NULL,
+    updated_at     TEXT NOT NULL,
+    timeline       TEXT,
+    closed_at      TEXT,  -- NULL while the visit is live
+    close_reason   TEXT   -- "abandoned" / "expired" / "handed_off", NULL when paid
+);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    code     TEXT,
+    name     TEXT NOT NULL,
+    qty      INTEGER NOT NULL,
+    price    INTEGER NOT NULL,
+    subtotal INTEGER NOT NULL,
+    category TEXT,
+    PRIMARY KEY (order_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS seen_messages (
+    id      TEXT PRIMARY KEY,
+    seen_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user, status);
+CREATE INDEX IF NOT EXISTS idx_orders_ref ON orders(order_ref);
+CREATE INDEX IF NOT EXISTS idx_orders_closed_at ON orders(closed_at);
+CREATE INDEX IF NOT EXISTS idx_orders_table ON orders(table_no);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
+CREATE INDEX IF NOT EXISTS idx_orders_timestamp ON orders(timestamp);
+CREATE INDEX IF NOT EXISTS idx_order_items_name ON order_items(name);
+CREATE INDEX IF NOT EXISTS idx_seen_messages_at ON seen_messages(seen_at);
+"""
+
+
+def connect(path, readonly=False):
+    """
+    Open a connection with the pragmas both the bot and the dashboard need.
+    Readers should pass readonly=True so they never take the write lock.
+    """
+    if readonly:
+        conn = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+    else:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across app crashes in WAL mode (only an OS crash
+        # can lose the last transactions) and avoids an fsync per commit.
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _timeline_json(order):
+    timeline = order.get("timeline")
+    return json.dumps(timeline) if timeline else None
+
+
+class SqliteOrderBackend:
+    def __init__(self, db_path, import_path=None, archive=None, export_path=None):
+        """
+        db_path:     sqlite database file
+        import_path: legacy orders_log.json imported once into an empty database
+        archive:     optional OrderArchive receiving closed orders
+        export_path: optional orders_log.json kept for the dashboard (see flush())
+        """
+        self.db_path = db_path
+        self.import_path = import_path
+        self.archive = archive
+        self.export_path = export_path
+        self._dirty = True  # export written once after load
+        self.orders = {}
+        self._row_ids = {}  # user_id -> orders.id of the active visit
+        self._row_refs = {}  # user_id -> order id (order_ref) that row holds
+        self._lock = threading.Lock()
+        self.state_lock = threading.Lock()  # see OrderJournal.state_lock
+        self.conn = None
+
+    # -----------------------------
+    # Startup
+    # -----------------------------
+    def load(self):
+        self.conn = connect(self.db_path)
+        self.conn.executescript(SCHEMA)
+
+        empty = self.conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone() is None
+        if empty and self.import_path and os.path.exists(self.import_path):
+            self._import_json(self.import_path)
+
+        rows = self.conn.execute(
+            "SELECT * FROM orders WHERE closed_at IS NULL ORDER BY id"
+        ).fetchall()
+        items = self.conn.execute(
+            """
+            SELECT i.* FROM order_items i
+            JOIN orders o ON o.id = i.order_id
+            WHERE o.closed_at IS NULL
+            ORDER BY i.order_id, i.position
+            """
+        ).fetchall()
+
+        by_order = {}
+        for it in items:
+            by_order.setdefault(it["order_id"], []).append(
+                {
+                    "code": it["code"],
+                    "name": it["name"],
+                    "qty": it["qty"],
+                    "price": it["price"],
+                    "subtotal": it["subtotal"],
+                    "category": it["category"],
+                }
+            )
+
+        self.orders = {}
+        self._row_ids = {}
+        self._row_refs = {}
+        for r in rows:
+            cart = Cart.from_list(by_order.get(r["id"], []))
+            order = {
+                "id": r["order_ref"],
+                "order": cart,
+                "total": cart.total,
+                "status": r["status"],
+                "timestamp": r["timestamp"],
+                "table": r["table_no"],
+                "updated_at": r["updated_at"],
+            }
+            if r["payment_method"]:
+                order["payment_method"] = r["payment_method"]
+            if r["timeline"]:
+                order["timeline"] = json.loads(r["timeline"])
+            if not order["id"]:
+                order["id"] = legacy_order_id(r["user"], order)
+            # If a user somehow has several active rows, the newest wins
+            self.orders[r["user"]] = order
+            self._row_ids[r["user"]] = r["id"]
+            self._row_refs[r["user"]] = order["id"]
+
+        # Seen ids older than a day are useless for dedup
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM seen_messages WHERE seen_at < ?", (time.time() - 86400,)
+            )
+
+        print(f"SQLite: restored {len(self.orders)} carts from {self.db_path}")
+        return self.orders
+
+    def load_seen(self):
+        rows = self.conn.execute(
+            "SELECT id, seen_at FROM seen_messages ORDER BY seen_at DESC LIMIT ?",
+            (SEEN_LIMIT,),
+        ).fetchall()
+        return [(r["id"], r["seen_at"]) for r in reversed(rows)]
+
+    def _import_json(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            return
+        # legacy orders are history, not open carts (see archive_legacy)
+        now = str(datetime.now())
+        with self.conn:
+            for user_id, order in data.items():
+                order = order_from_json(order)
+                order.setdefault("id", legacy_order_id(user_id, order))
+                closed_at = order.get("updated_at") or order.get("timestamp") or now
+                self._insert_order(user_id, order, closed_at, closed_at=closed_at)
+        if self.archive is not None:
+            archive_legacy(self.archive, data)
+        print(f"SQLite: imported {len(data)} legacy orders from {path} as closed visits")
+
+    # -----------------------------
+    # Writes
+    # -----------------------------
+    def append(self, event):
+        self.append_many([event])
+
+    def append_many(self, events):
+        """
+        Apply a batch of events in memory, then write every touched visit
+        in ONE transaction (one commit for the whole batch).
+        """
+        if not events:
+            return
+        with self._lock:
+            touched = []
+            seen = []
+            closed = {}  # user_id -> (order, closed_at)
+            with self.state_lock:
+                for event in events:
+                    if event["op"] == "seen":
+                        seen.append((event["id"], event["at"]))
+                        continue
+                    event.setdefault("ts", str(datetime.now()))
+                    order = apply_event(self.orders, event)
+                    if order is not None:
+                        closed[event["user"]] = (order, event["ts"])
+                    if event["user"] not in touched:
+                        touched.append(event["user"])
+            if touched:
+                self._dirty = True
+
+            # Archive before the commit: if we crash in between, the row is
+            # still live and closing it again is a no-op for the archive.
+            if self.archive is not None:
+                for user_id, (order, closed_at) in closed.items():
+                    self.archive.append(user_id, order, closed_at)
+
+            now = str(datetime.now())
+            with self.conn:
+                if seen:
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO seen_messages (id, seen_at) VALUES (?, ?)",
+                        seen,
+                    )
+                for user_id in touched:
+                    self._sync_user(user_id, now, closed.get(user_id))
+
+    def _sync_user(self, user_id, now, closed=None):
+        """
+        closed: (order, closed_at) if the user's visit closed in this batch.
+        """
+        order = self.orders.get(user_id)
+        row_id = self._row_ids.get(user_id)
+
+        if closed is not None:
+            # Closed: the row keeps the final state as history
+            closed_order, closed_at = closed
+            if row_id is None:
+                self._insert_order(user_id, closed_order, now, closed_at)
+            else:
+                self._update_order(row_id, closed_order, now, closed_at)
+                self._forget_row(user_id)
+                row_id = None
+
+        if row_id is not None and (order is None or order.get("id") != self._row_refs.get(user_id)):
+            # Cart cancelled / emptied: nothing was sold, drop the row (items cascade)
+            self.conn.execute("DELETE FROM orders WHERE id = ?", (row_id,))
+            self._forget_row(user_id)
+            row_id = None
+
+        if order is None:
+            return
+
+        if row_id is None:
+            self._row_ids[user_id] = self._insert_order(user_id, order, now)
+            self._row_refs[user_id] = order.get("id")
+            return
+
+        self._update_order(row_id, order, now)
+
+    def _update_order(self, row_id, order, now, closed_at=None):
+        self.conn.execute(
+            """
+            UPDATE orders
+            SET order_ref = ?, table_no = ?, status = ?, total = ?, payment_method = ?,
+                updated_at = ?, timeline = ?, closed_at = ?, close_reason = ?
+            WHERE id = ?
+            """,
+            (
+                order.get("id"),
+                order.get("table"),
+                order["status"],
+                order["total"],
+                order.get("payment_method"),
+                now,
+                _timeline_json(order),
+                None if closed_at is None else str(closed_at),
+                order.get("close_reason"),
+                row_id,
+            ),
+        )
+        self.conn.execute("DELETE FROM order_items WHERE order_id = ?", (row_id,))
+        self._insert_items(row_id, order)
+
+    def _forget_row(self, user_id):
+        del self._row_ids[user_id]
+        self._row_refs.pop(user_id, None)
+
+    def _insert_order(self, user_id, order, now, closed_at=None):
+        cur = self.conn.execute(
+            """
+            INSERT INTO orders
+                (order_ref, user, table_no, status, total, payment_method,
+                 timestamp, updated_at, timeline, closed_at, close_reason)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                order.get("id"),
+                user_id,
+                order.get("table"),
+                order.get("status", "unpaid"),
+                order.get("total", 0),
+                order.get("payment_method"),
+                order.get("timestamp") or now,
+                now,
+                _timeline_json(order),
+                None if closed_at is None else str(closed_at),
+                order.get("close_reason"),
+            ),
+        )
+        self._insert_items(cur.lastrowid, order)
+        return cur.lastrowid
+
+    def _insert_items(self, row_id, order):
+        self.conn.executemany(
+            """
+            INSERT INTO order_items
+                (order_id, position, code, name, qty, price, subtotal, category)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    row_id,
+                    pos,
+                    line.code,
+                    line.name,
+                    line.qty,
+                    line.price,
+                    line.subtotal,
+                    line.category,
+                )
+                for pos, line in enumerate(order["order"])
+            ],
+        )
+
+    def flush(self):
+        """
+        Rewrite the dashboard export if the live orders changed since the
+        last flush (every batch itself is committed in append_many).
+        """
+        with self._lock:
+            if self.export_path and self._dirty and self.conn is not None:
+                _write_json_atomic(self.export_path, self.orders, indent=4)
+                self._dirty = False
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
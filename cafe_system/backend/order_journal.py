@@ -0,0 +1,384 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+from datetime import datetime
+
+from cart import Cart, json_default, order_from_json
+from order_lifecycle import OPEN
+
+# -----------------------------
+# Append-only order journal
+# -----------------------------
+# Every cart change is written as ONE json line (one event) and fsync'd,
+# so a write costs O(1) regardless of how many carts are open.
+# State is rebuilt at startup from the last snapshot + the journal tail.
+# Periodically the state is compacted into a snapshot and the journal
+# is truncated, which keeps replay short.
+#
+# State is the phone -> active order index: {user_id: order}. Every visit
+# is its own order with an "id"; once it closes (or is cancelled) the next
+# message starts a new one. Past orders are indexed by OrderArchive.
+#
+# Orders in a pre-journal orders_log.json are history, not open carts:
+# on first start they are moved straight into the archive (see
+# archive_legacy) instead of into the live state.
+#
+# Event shapes (all carry "op", "user", "ts" and a monotonically
+# increasing "seq" assigned by the journal):
+#   {"op": "add_items", "items": [{code, name, qty, price, subtotal, category}],
+#    "table": str|None, "order_id": id used if this starts a new order}
+#   {"op": "remove_qty", "index": int (0-based), "qty": int}
+#   {"op": "set_table", "table": str, "order_id": as for add_items}
+#   {"op": "cancel", "reason"?: "abandoned"}  (abandoned carts -> OrderArchive)
+#   {"op": "pay", "method": "QRIS" | "CASH" | "VA"}
+#   {"op": "status", "status": see order_lifecycle}
+#   {"op": "close", "reason"?: "expired" | "handed_off"}  (order leaves the live state -> OrderArchive)
+#   {"op": "seen", "id": wa message id, "at": epoch seconds}  (dedup only)
+
+SNAPSHOT_EVERY = 200  # events between compactions
+SNAPSHOT_INTERVAL = 15  # seconds between compactions (checked on append / flush)
+SEEN_LIMIT = 20000  # seen message ids kept in the snapshot
+
+
+def new_order_id():
+    """
+    "20261017-3f9a2c1b": visit date + random suffix.
+    """
+    return f"{datetime.now():%Y%m%d}-{uuid.uuid4().hex[:8]}"
+
+
+def legacy_order_id(user_id, order):
+    """
+    Stable id for orders stored before visits had ids.
+    """
+    digits = re.sub(r"\D", "", str(order.get("timestamp") or ""))[:14]
+    return f"{user_id}-{digits}"
+
+
+def archive_legacy(archive, orders):
+    """
+    Move orders from a pre-journal orders_log.json ({user_id: order}) into
+    the archive with the status they had, dated by their last change.
+    Idempotent (see OrderArchive.append). Returns how many were archived.
+    """
+    archived = 0
+    for user_id, order in orders.items():
+        order = order_from_json(order)
+        if not order.get("id"):
+            order["id"] = legacy_order_id(user_id, order)
+        closed_at = order.get("updated_at") or order.get("timestamp") or datetime.now()
+        if archive.append(user_id, order, closed_at):
+            archived += 1
+    return archived
+
+
+def new_order(ts, table=None, order_id=None):
+    return {
+        "id": order_id,
+        "order": Cart(),
+        "total": 0,
+        "status": OPEN,
+        "timestamp": ts,
+        "table": table or None,
+        "timeline": {OPEN: ts},
+        "updated_at": ts,
+    }
+
+
+def _event_order_id(event):
+    # events journaled before order ids existed
+    return event.get("order_id") or legacy_order_id(event["user"], {"timestamp": event["ts"]})
+
+
+def apply_event(orders, event):
+    """
+    Apply a single journal event to the in-memory orders dict (mutates it).
+    Must stay deterministic: replaying the same events gives the same state.
+    Returns the removed order for "close" and for abandoned carts (both
+    go to the archive with the status they reached), else None.
+    """
+    op = event["op"]
+    user_id = event["user"]
+
+    if op == "add_items":
+        table = event.get("table")
+        if user_id not in orders:
+            orders[user_id] = new_order(event["ts"], table, _event_order_id(event))
+        order = orders[user_id]
+        if table and not order.get("table"):
+            order["table"] = table
+        order["updated_at"] = event["ts"]
+
+        cart = order["order"]
+        for item in event["items"]:
+            cart.add(
+                Cart.key_of(item),
+                item["name"],
+                item["qty"],
+                item["price"],
+                item.get("category"),
+            )
+        order["total"] = cart.total
+
+    elif op == "remove_qty":
+        order = orders.get(user_id)
+        if not order:
+            return
+        cart = order["order"]
+        if cart.line_at(event["index"]) is None:
+            return
+        cart.remove_at(event["index"], event["qty"])
+        order["total"] = cart.total
+        order["updated_at"] = event["ts"]
+        if not cart:
+            del orders[user_id]
+
+    elif op == "set_table":
+        if user_id not in orders:
+            orders[user_id] = new_order(event["ts"], event["table"], _event_order_id(event))
+        else:
+            orders[user_id]["table"] = event["table"]
+            orders[user_id]["updated_at"] = event["ts"]
+
+    elif op == "cancel":
+        order = orders.pop(user_id, None)
+        if order is not None and event.get("reason") == "abandoned":
+            order["close_reason"] = "abandoned"
+            return order
+
+    elif op == "pay":
+        if user_id in orders:
+            orders[user_id]["payment_method"] = event.get("method")
+
+    elif op == "status":
+        order = orders.get(user_id)
+        if order:
+            order["status"] = event["status"]
+            order.setdefault("timeline", {})[event["status"]] = event["ts"]
+
+    elif op == "close":
+        order = orders.pop(user_id, None)
+        if order is not None and event.get("reason"):
+            order["close_reason"] = event["reason"]
+        return order
+
+    elif op == "seen":
+        # Dedup marker, tracked by the storage backend; no cart change
+        pass
+
+    else:
+        print("Journal: unknown op", op)
+
+
+def _write_json_atomic(path, data, indent=None):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False, default=json_default)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class OrderJournal:
+    """
+    journal_path:  append-only JSON lines file (one event per line)
+    snapshot_path: compacted state {"seq": N, "orders": {...}}
+    export_path:   optional plain orders dict (orders_log.json) kept for the
+                   dashboard; refreshed on every compaction.
+    archive:       optional OrderArchive receiving closed orders.
+    """
+
+    def __init__(
+        self,
+        journal_path,
+        snapshot_path,
+        export_path=None,
+        archive=None,
+        snapshot_every=SNAPSHOT_EVERY,
+        snapshot_interval=SNAPSHOT_INTERVAL,
+        seen_limit=SEEN_LIMIT,
+    ):
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.export_path = export_path
+        self.archive = archive
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        self.seen_limit = seen_limit
+
+        self.orders = {}
+        self.seen = {}  # msg_id -> seen_at, oldest first
+        self.seq = 0
+        self._since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+        self._lock = threading.Lock()
+        # held only while events are applied to self.orders, so readers on
+        # the event loop can iterate it without waiting for an fsync
+        self.state_lock = threading.Lock()
+        self._fh = None
+
+    # -----------------------------
+    # Startup
+    # -----------------------------
+    def replay(self):
+        """
+        Rebuild state: snapshot (or legacy export file) + journal events
+        with seq > snapshot seq. A torn last line (crash mid-write) is ignored.
+        """
+        orders = {}
+        seq = 0
+        migrated = 0
+        self.seen = {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            orders = snap.get("orders", {})
+            seq = snap.get("seq", 0)
+            self.seen = snap.get("seen", {})
+        elif self.export_path and os.path.exists(self.export_path):
+            # First start after migrating from the whole-file JSON format
+            try:
+                with open(self.export_path, "r", encoding="utf-8") as f:
+                    orders = json.load(f)
+            except json.JSONDecodeError:
+                orders = {}
+            if self.archive is not None:
+                migrated = archive_legacy(self.archive, orders)
+                orders = {}
+
+        for user_id, order in orders.items():
+            order_from_json(order)
+            if not order.get("id"):
+                order["id"] = legacy_order_id(user_id, order)
+
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        print("Journal: skipping torn line")
+                        continue
+                    if event.get("seq", 0) <= seq:
+                        continue
+                    # closes re-archive idempotently (we may have crashed
+                    # between the journal write and the archive append)
+                    self._archive(event, apply_event(orders, event))
+                    self._track_seen(event)
+                    seq = event["seq"]
+                    replayed += 1
+
+        self.orders = orders
+        self.seq = seq
+        self._since_snapshot = replayed
+        self._fh = open(self.journal_path, "a", encoding="utf-8")
+        if migrated:
+            # snapshot now, so the export stops listing the archived orders
+            self._compact_locked()
+            print(f"Journal: archived {migrated} legacy orders from {self.export_path}")
+        print(f"Journal: restored {len(orders)} carts, replayed {replayed} events")
+        return self.orders
+
+    def load(self):
+        return self.replay()
+
+    def load_seen(self):
+        return list(self.seen.items())
+
+    def _archive(self, event, closed):
+        if closed is not None and self.archive is not None:
+            self.archive.append(event["user"], closed, event["ts"])
+
+    def _track_seen(self, event):
+        if event["op"] == "seen":
+            self.seen.pop(event["id"], None)
+            self.seen[event["id"]] = event["at"]
+
+    # -----------------------------
+    # Writes
+    # -----------------------------
+    def append(self, event):
+        self.append_many([event])
+
+    def append_many(self, events):
+        """
+        Apply + persist a batch of events with a single fsync.
+        """
+        if not events:
+            return
+        with self._lock:
+            lines = []
+            closed = []
+            with self.state_lock:
+                for event in events:
+                    self.seq += 1
+                    event["seq"] = self.seq
+                    event.setdefault("ts", str(datetime.now()))
+                    closed.append((event, apply_event(self.orders, event)))
+                    self._track_seen(event)
+                    lines.append(json.dumps(event, ensure_ascii=False))
+
+            self._fh.write("\n".join(lines) + "\n")
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            # Archive only once the close is durable in the journal
+            for event, order in closed:
+                self._archive(event, order)
+
+            self._since_snapshot += len(events)
+            if (
+                self._since_snapshot >= self.snapshot_every
+                or time.monotonic() - self._last_snapshot >= self.snapshot_interval
+            ):
+                self._compact_locked()
+
+    # -----------------------------
+    # Compaction
+    # -----------------------------
+    def compact(self):
+        with self._lock:
+            self._compact_locked()
+
+    def flush(self):
+        """
+        Compact if anything was appended since the last compaction. Called
+        on a timer (OrderStore), so orders_log.json never lags by more than
+        the flush interval even when no further writes come in.
+        """
+        with self._lock:
+            if self._fh is not None and self._since_snapshot:
+                self._compact_locked()
+
+    def _compact_locked(self):
+        # 1. Durable snapshot that records which seq it covers
+        if len(self.seen) > self.seen_limit:
+            self.seen = dict(list(self.seen.items())[-self.seen_limit:])
+        _write_json_atomic(
+            self.snapshot_path,
+            {"seq": self.seq, "orders": self.orders, "seen": self.seen},
+        )
+        # 2. Export for the dashboard (same shape as the old orders_log.json)
+        if self.export_path:
+            _write_json_atomic(self.export_path, self.orders, indent=4)
+        # 3. Truncate the journal. If we crash before this, replay skips
+        #    events with seq <= snapshot seq, so nothing is applied twice.
+        self._fh.close()
+        self._fh = open(self.journal_path, "w", encoding="utf-8")
+        self._since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._fh is None:
+                return
+            if self._since_snapshot:
+                self._compact_locked()
+            self._fh.close()
+            self._fh = None
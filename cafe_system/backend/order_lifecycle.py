@@ -0,0 +1,50 @@
+# -----------------------------
+# Order lifecycle
+# -----------------------------
+#   open -> submitted -> preparing -> served -> paid -> closed
+#
+# open:      customer is still building the cart (the only editable state)
+# submitted: customer picked a payment method; the order is in the kitchen queue
+# preparing: kitchen started it
+# served:    delivered to the table
+# paid:      cashier confirmed the payment
+# closed:    moved out of the live orders into the dated archive
+#
+# An order can be cancelled while it is open or submitted (nothing cooked yet).
+# Orders written before the lifecycle existed carry "unpaid", read as open.
+
+OPEN = "open"
+SUBMITTED = "submitted"
+PREPARING = "preparing"
+SERVED = "served"
+PAID = "paid"
+CLOSED = "closed"
+CANCELLED = "cancelled"
+
+LIFECYCLE = (OPEN, SUBMITTED, PREPARING, SERVED, PAID, CLOSED)
+LIVE_STATUSES = (OPEN, SUBMITTED, PREPARING, SERVED, PAID)
+KITCHEN_STATUSES = (SUBMITTED, PREPARING)
+CANCELLABLE = (OPEN, SUBMITTED)
+
+TRANSITIONS = {
+    OPEN: (SUBMITTED,),
+    SUBMITTED: (PREPARING,),
+    PREPARING: (SERVED,),
+    SERVED: (PAID,),
+    PAID: (CLOSED,),
+}
+
+LEGACY_STATUSES = {"unpaid": OPEN}
+
+
+def status_of(order):
+    status = order.get("status") or OPEN
+    return LEGACY_STATUSES.get(status, status)
+
+
+def can_move(order, status):
+    return status in TRANSITIONS.get(status_of(order), ())
+
+
+def is_editable(order):
+    return status_of(order) == OPEN
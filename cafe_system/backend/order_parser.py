@@ -0,0 +1,174 @@
+import re
+
+from intent_parser import normalize
+from menu_index import trigrams
+
+# -----------------------------
+# Free-text order parser
+# -----------------------------
+# "mau lasagne 2 dan teh 1", "2x greek salad, 1 coffee", "i want paela"
+# are resolved against the menu locally (token + trigram index), so the
+# order goes straight into the cart instead of the agent replying and
+# bouncing the customer to the catalog. Only ambiguous names ("salad")
+# need a question back.
+#
+# Quantities also split items when there is no separator ("lasagne 2 tea
+# 1", "2 lasagne 1 tea"). Words that match nothing are kept as unknown
+# phrases so the reply can name them, a quantity of 0 or above MAX_QTY is
+# asked back instead of clamped, and questions ("tea?") go to the agent.
+
+SEPARATOR_RE = re.compile(r"\s*(?:,|;|\+|&|\n|\band\b|\bdan\b|\bsama\b|\bplus\b)\s*", re.I)
+QTY_RE = re.compile(r"^(?:x?(\d+)x?|(\d+)(?:pcs|porsi))$")
+
+QTY_WORDS = {
+    "satu": 1, "dua": 2, "tiga": 3, "empat": 4, "lima": 5,
+    "enam": 6, "tujuh": 7, "delapan": 8, "sembilan": 9, "sepuluh": 10,
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4,
+    "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+
+# Words that signal an order ...
+ORDER_WORDS = {
+    "mau", "pesan", "pesen", "order", "tambah", "minta", "beli", "want",
+    "add", "get",
+}
+# ... and filler around the item names ("have" is filler, not a cue:
+# "do you have coffee" is a question)
+FILLER_WORDS = ORDER_WORDS | {
+    "saya", "aku", "i", "we", "kami", "please", "pls", "tolong", "dong",
+    "ya", "yg", "yang", "porsi", "pcs", "x", "gelas", "cup", "cups",
+    "piring", "buah", "lagi", "juga", "also", "more", "would", "d", "ll",
+    "to", "the", "of", "some", "like", "nya", "ingin", "untuk", "for", "me",
+    "have",
+}
+
+MAX_QTY = 50
+NEAR_TOKEN = 0.3  # trigram similarity for a typo to still count as a name's word
+
+
+class ParsedOrder:
+    __slots__ = ("lines", "ambiguous", "unknown", "bad_qty", "has_cue", "question")
+
+    def __init__(self):
+        self.lines = []  # [(MenuItem, qty)]
+        self.ambiguous = []  # [(phrase, [MenuItem, ...], qty)]
+        self.unknown = []  # [phrase]
+        self.bad_qty = []  # [(name or phrase, qty)] with qty outside 1..MAX_QTY
+        self.has_cue = False  # quantity or order verb present
+        self.question = False  # the text ends with "?"
+
+    def is_order(self):
+        """
+        Treat the text as an order only if it clearly was one: not a
+        question, something resolved, and either every part named a menu
+        item or the customer used a quantity / order word (then the parts
+        that matched nothing are reported back, not dropped).
+        """
+        if self.question or not (self.lines or self.ambiguous or self.bad_qty):
+            return False
+        if self.unknown:
+            return self.has_cue and bool(self.lines or self.bad_qty)
+        return bool(self.lines or self.bad_qty) or self.has_cue
+
+
+def _qty_of(word):
+    match = QTY_RE.match(word)
+    if match:
+        return int(match.group(1) or match.group(2))
+    return QTY_WORDS.get(word)
+
+
+def _groups(words):
+    """
+    Split a segment's words into one (qty or None, words, qty_first) group
+    per item at quantity tokens, so "lasagne 2 tea 1" and "2 lasagne 1 tea"
+    name two items without a separator. Whether quantities come before or
+    after the names is read from the first word.
+    """
+    marks = [i for i, word in enumerate(words) if _qty_of(word) is not None]
+    if not marks:
+        return [(None, words, False)]
+    qty_first = marks[0] == 0
+    if qty_first:
+        starts = marks
+    else:
+        starts = [0] + [i + 1 for i in marks]
+    groups = []
+    for start, end in zip(starts, starts[1:] + [len(words)]):
+        chunk = words[start:end]
+        if not chunk:
+            continue
+        if qty_first:
+            qty, chunk = _qty_of(chunk[0]), chunk[1:]
+        elif start + len(chunk) - 1 in marks:
+            qty, chunk = _qty_of(chunk[-1]), chunk[:-1]
+        else:
+            qty = None  # trailing names after the last quantity
+        groups.append((qty, chunk, qty_first))
+    return groups
+
+
+def _covers(item, words):
+    """
+    True if every word belongs to the item's name / aliases (typos allowed).
+    """
+    return all(
+        word in item.tokens
+        or any(
+            len(trigrams(word) & trigrams(token)) / len(trigrams(word) | trigrams(token)) >= NEAR_TOKEN
+            for token in item.tokens
+        )
+        for word in words
+    )
+
+
+def _resolve(words, menu):
+    """
+    [(phrase, item, candidates)] for a run of words naming one or more
+    items: "lasagne tea" is two, and in "lasagne foo" the "foo" comes back
+    as its own phrase with no item instead of being swallowed by the match.
+    """
+    phrase = " ".join(words)
+    item, candidates = menu.match_phrase(phrase)
+    if item is None or len(words) == 1 or _covers(item, words):
+        return [(phrase, item, candidates)]
+    for cut in range(len(words) - 1, 0, -1):
+        head, _ = menu.match_phrase(" ".join(words[:cut]))
+        if head is not None and _covers(head, words[:cut]):
+            return [(" ".join(words[:cut]), head, [])] + _resolve(words[cut:], menu)
+    return [(phrase, item, candidates)]
+
+
+def parse_order_text(text, menu):
+    parsed = ParsedOrder()
+    parsed.question = text.rstrip().endswith("?")
+    for segment in SEPARATOR_RE.split(text):
+        words = normalize(segment).split()
+        if not words:
+            continue
+        if ORDER_WORDS.intersection(words):
+            parsed.has_cue = True
+        words = [w for w in words if w not in FILLER_WORDS]
+        for qty, chunk, qty_first in _groups(words):
+            if qty is not None:
+                parsed.has_cue = True
+            if not chunk:
+                continue
+            parts = _resolve(chunk, menu)
+            # the quantity belongs to the name next to it
+            owner = parts[0] if qty_first else parts[-1]
+            for part in parts:
+                phrase, item, candidates = part
+                part_qty = qty if part is owner else None
+                if part_qty is not None and not 1 <= part_qty <= MAX_QTY:
+                    # ask back rather than guess what was meant
+                    parsed.bad_qty.append((item.name if item else phrase, part_qty))
+                    continue
+                part_qty = part_qty or 1
+                if item is not None:
+                    parsed.lines.append((item, part_qty))
+                elif candidates:
+                    parsed.ambiguous.append((phrase, candidates, part_qty))
+                else:
+                    parsed.unknown.append(phrase)
+    return parsed
@@ -0,0 +1,423 @@
+import time
+import asyncio
+import weakref
+from datetime import datetime
+
+from dedup import SeenMessages
+from order_journal import new_order_id
+from order_lifecycle import (
+    CANCELLABLE,
+    CLOSED,
+    KITCHEN_STATUSES,
+    OPEN,
+    PAID,
+    SUBMITTED,
+    can_move,
+    is_editable,
+    status_of,
+)
+
+
+# -----------------------------
+# In-process order store
+# -----------------------------
+# Carts are kept in memory (this process is the only writer), so reads
+# never touch the disk. Each customer (from_no) gets its own asyncio lock,
+# so two messages from the same customer can't interleave their
+# read-modify-write, while different customers never wait on each other.
+#
+# Storage is pluggable. A backend must provide:
+#   load()               -> dict of user_id -> order (the live state it maintains)
+#   load_seen()          -> [(msg_id, seen_at)] of persisted dedup markers
+#   append_many(events)  -> apply + persist a batch of events (see order_journal)
+#   flush()              -> write out anything deferred (e.g. the dashboard export)
+#   close()
+#   state_lock           -> threading.Lock held while events are applied to
+#                           the live dict (not during the disk write)
+# Backend calls are blocking (fsync / sqlite), so they run in a worker thread.
+# start() runs flush() every FLUSH_INTERVAL, so deferred output such as
+# orders_log.json lags by a bounded time even when traffic stops.
+# Readers that walk the whole live set (snapshot, kitchen queue, find) do
+# it under state_lock, since a write for another customer may be applying
+# in that thread meanwhile.
+#
+# Orders follow the lifecycle in order_lifecycle: only open carts can be
+# edited; paying closes the order, which moves it into the archive.
+#
+# Each visit is its own order with an id. self.orders is the phone ->
+# active order index (O(1) per message); the archive indexes phone ->
+# past orders. An open cart left idle for VISIT_IDLE_TIMEOUT is abandoned,
+# so the next message starts a new visit instead of reviving it. Ordering
+# again after submitting hands off the same way: the submitted order is
+# archived with the status it reached and the items start a new visit, so
+# a customer is never locked out waiting for staff to move the order on.
+#
+# Customers who never write again would keep their cart in the live set
+# forever, so start() also sweeps every SWEEP_INTERVAL: idle open carts
+# are abandoned and orders past "open" that nobody moved on for
+# STUCK_TIMEOUT expire. Either way the order is archived with the status
+# it reached and a "close_reason", so the sales history keeps it.
+#
+# With a bus (event_bus.EventBus), every change is published after it is
+# persisted: "order.updated" with the order's current view, and
+# "order.removed" when a visit is closed or cancelled.
+
+VISIT_IDLE_TIMEOUT = 6 * 3600  # seconds
+STUCK_TIMEOUT = 24 * 3600  # seconds
+FLUSH_INTERVAL = 5  # seconds
+SWEEP_INTERVAL = 300  # seconds
+
+
+def order_view(user_id, order):
+    """
+    JSON-friendly summary of a live order for streams / kitchen screens.
+    """
+    return {
+        "order_id": order.get("id"),
+        "user": user_id,
+        "table": order.get("table"),
+        "status": status_of(order),
+        "total": order["total"],
+        "payment_method": order.get("payment_method"),
+        "items": [
+            {"code": line.code, "name": line.name, "qty": line.qty}
+            for line in order["order"]
+        ],
+        "timeline": dict(order.get("timeline", {})),
+    }
+
+
+class OrderStore:
+    def __init__(
+        self,
+        backend,
+        archive=None,
+        bus=None,
+        idle_timeout=VISIT_IDLE_TIMEOUT,
+        stuck_timeout=STUCK_TIMEOUT,
+    ):
+        """
+        archive: the OrderArchive closed orders go to (for past_orders())
+        bus:     optional EventBus order changes are published on
+        """
+        self.backend = backend
+        self.archive = archive
+        self.bus = bus
+        self.idle_timeout = idle_timeout
+        self.stuck_timeout = stuck_timeout
+        self.swept = 0
+        self.orders = {}
+        self.seen = SeenMessages()
+        self._locks = weakref.WeakValueDictionary()
+        self._flusher = None
+
+    def open(self):
+        self.orders = self.backend.load()
+        self.seen.load(self.backend.load_seen())
+
+    async def start(self, interval=FLUSH_INTERVAL, sweep_every=SWEEP_INTERVAL):
+        self._flusher = asyncio.create_task(self._housekeeping(interval, sweep_every))
+
+    async def _housekeeping(self, interval, sweep_every):
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if time.monotonic() - last_sweep >= sweep_every:
+                    last_sweep = time.monotonic()
+                    swept = await self.sweep()
+                    if swept:
+                        print(f"Order store: swept {swept} stale orders")
+                await asyncio.to_thread(self.backend.flush)
+            except Exception as e:
+                print("Order store housekeeping failed:", e)
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await asyncio.to_thread(self.backend.close)
+
+    def lock(self, user_id):
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    async def _write(self, *events):
+        before = {e["user"]: self.orders.get(e["user"]) for e in events if e["op"] != "seen"}
+        await asyncio.to_thread(self.backend.append_many, list(events))
+        if self.bus is not None:
+            for user_id, old in before.items():
+                ops = [e["op"] for e in events if e["user"] == user_id]
+                self._publish(user_id, old, ops)
+
+    def _publish(self, user_id, old, ops):
+        order = self.orders.get(user_id)
+        if old is not None and (order is None or order.get("id") != old.get("id")):
+            self.bus.publish(
+                "order.removed",
+                {
+                    "order_id": old.get("id"),
+                    "user": user_id,
+                    "reason": "closed" if "close" in ops else "cancelled",
+                },
+            )
+        if order is not None:
+            self.bus.publish("order.updated", order_view(user_id, order))
+
+    def snapshot(self):
+        """
+        Views of every live order (first message of a fresh stream).
+        """
+        with self.backend.state_lock:
+            return [order_view(user_id, order) for user_id, order in self.orders.items()]
+
+    # -----------------------------
+    # Reads
+    # -----------------------------
+    async def get(self, user_id):
+        async with self.lock(user_id):
+            return self.orders.get(user_id)
+
+    async def cart_state(self, user_id):
+        """
+        Numbered cart lines in the shape the AI agent expects.
+        """
+        order = await self.get(user_id)
+        if not order:
+            return []
+        return [
+            {
+                "index": idx,
+                "name": line.name,
+                "qty": line.qty,
+                "subtotal": line.subtotal,
+            }
+            for idx, line in enumerate(order["order"], start=1)
+        ]
+
+    def find(self, order_id):
+        """
+        (user_id, order) of a live order by id, or None. Scans the live
+        set, which only holds the current working set.
+        """
+        with self.backend.state_lock:
+            for user_id, order in self.orders.items():
+                if order.get("id") == order_id:
+                    return user_id, order
+        return None
+
+    def past_orders(self, user_id):
+        """
+        [(order_id, archive day)] of the customer's closed visits.
+        """
+        if self.archive is None:
+            return []
+        return self.archive.orders_of(user_id)
+
+    def kitchen_queue(self):
+        """
+        Views (see order_view) of submitted / preparing orders, oldest
+        submission first.
+        """
+        with self.backend.state_lock:
+            queue = [
+                order_view(user_id, order)
+                for user_id, order in self.orders.items()
+                if status_of(order) in KITCHEN_STATUSES
+            ]
+        queue.sort(key=lambda view: view["timeline"].get(SUBMITTED, ""))
+        return queue
+
+    # -----------------------------
+    # Message dedup
+    # -----------------------------
+    def is_duplicate(self, msg_id):
+        return self.seen.check(msg_id)
+
+    async def mark_seen_many(self, pairs):
+        """
+        pairs: [(user_id, msg_id)] accepted from one webhook payload.
+        Remembered in memory right away, then persisted in ONE backend
+        write so the dedup survives a restart.
+        """
+        if not pairs:
+            return
+        at = time.time()
+        events = []
+        for user_id, msg_id in pairs:
+            self.seen.add(msg_id, at)
+            events.append({"op": "seen", "user": user_id, "id": msg_id, "at": at})
+        await self._write(*events)
+
+    # -----------------------------
+    # Writes
+    # -----------------------------
+    @staticmethod
+    def _idle_seconds(order):
+        """
+        Seconds since the order last changed (cart edit or status step),
+        None if its timestamps can't be read.
+        """
+        stamps = [order.get("updated_at"), order.get("timestamp")]
+        stamps += list(order.get("timeline", {}).values())
+        try:
+            last = max(datetime.fromisoformat(str(t)) for t in stamps if t)
+        except ValueError:
+            return None
+        return (datetime.now() - last).total_seconds()
+
+    def _is_stale(self, order):
+        if status_of(order) != OPEN:
+            return False
+        idle = self._idle_seconds(order)
+        return idle is not None and idle > self.idle_timeout
+
+    def _is_stuck(self, order):
+        if status_of(order) == OPEN:
+            return False
+        idle = self._idle_seconds(order)
+        return idle is not None and idle > self.stuck_timeout
+
+    async def sweep(self):
+        """
+        Abandon idle open carts and close stuck orders into the archive.
+        Returns how many orders left the live set.
+        """
+        with self.backend.state_lock:
+            candidates = [
+                user_id
+                for user_id, order in self.orders.items()
+                if self._is_stale(order) or self._is_stuck(order)
+            ]
+        swept = 0
+        for user_id in candidates:
+            async with self.lock(user_id):
+                order = self.orders.get(user_id)
+                if order is None:
+                    continue
+                if self._is_stale(order):
+                    event = {"op": "cancel", "user": user_id, "reason": "abandoned"}
+                elif self._is_stuck(order):
+                    event = {"op": "close", "user": user_id, "reason": "expired"}
+                else:
+                    continue  # the customer / staff got to it meanwhile
+                await self._write(event)
+                swept += 1
+        self.swept += swept
+        return swept
+
+    def _visit(self, user_id, hand_off=False):
+        """
+        Events to run before a change that may start a visit, and the
+        order id such a new visit gets. hand_off=True starts a new visit
+        when the current order is past "open". Call with the user's lock held.
+        """
+        order = self.orders.get(user_id)
+        if order is None:
+            return [], new_order_id()
+        if self._is_stale(order):
+            abandon = {"op": "cancel", "user": user_id, "reason": "abandoned"}
+            return [abandon], new_order_id()
+        if hand_off and not is_editable(order):
+            handed_off = {"op": "close", "user": user_id, "reason": "handed_off"}
+            return [handed_off], new_order_id()
+        return [], order["id"]
+
+    async def add_items(self, user_id, items, table=None):
+        """
+        items: list of {code, name, qty, price, subtotal}
+        Returns the order. If the current one is already past "open", it
+        is archived and the items start a new visit.
+        """
+        async with self.lock(user_id):
+            prefix, order_id = self._visit(user_id, hand_off=True)
+            await self._write(
+                *prefix,
+                {
+                    "op": "add_items",
+                    "user": user_id,
+                    "items": items,
+                    "table": table,
+                    "order_id": order_id,
+                },
+            )
+            return self.orders[user_id]
+
+    async def remove(self, user_id, index, qty=None):
+        """
+        Remove `qty` of cart line `index` (0-based). qty None / <= 0 removes the line.
+        Returns (item_before, removed_qty, order_after) or None if the line doesn't exist.
+        order_after is None when the cart became empty.
+        """
+        async with self.lock(user_id):
+            order = self.orders.get(user_id)
+            if not order or not is_editable(order):
+                return None
+            line = order["order"].line_at(index)
+            if line is None:
+                return None
+            item = line.to_dict()
+            if qty is None or qty <= 0 or qty > item["qty"]:
+                qty = item["qty"]
+            await self._write(
+                {"op": "remove_qty", "user": user_id, "index": index, "qty": qty}
+            )
+            return item, qty, self.orders.get(user_id)
+
+    async def set_table(self, user_id, table):
+        async with self.lock(user_id):
+            prefix, order_id = self._visit(user_id)
+            await self._write(
+                *prefix,
+                {"op": "set_table", "user": user_id, "table": table, "order_id": order_id},
+            )
+
+    async def clear(self, user_id):
+        async with self.lock(user_id):
+            order = self.orders.get(user_id)
+            if not order or status_of(order) not in CANCELLABLE:
+                return False
+            await self._write({"op": "cancel", "user": user_id})
+            return True
+
+    async def submit(self, user_id, method):
+        """
+        Customer picked a payment method: open -> submitted (kitchen queue).
+        Returns the order, or None if there is no open, non-empty cart.
+        """
+        async with self.lock(user_id):
+            order = self.orders.get(user_id)
+            if not order or not order["order"] or not can_move(order, SUBMITTED):
+                return None
+            await self._write(
+                {"op": "pay", "user": user_id, "method": method},
+                {"op": "status", "user": user_id, "status": SUBMITTED},
+            )
+            return order
+
+    async def advance(self, user_id, status, order_id=None):
+        """
+        Staff-driven step (preparing / served / paid). Paying also closes
+        the order in the same write. Returns the order, or None if the
+        transition isn't allowed from its current status (or the active
+        order is no longer `order_id`).
+        """
+        async with self.lock(user_id):
+            order = self.orders.get(user_id)
+            if not order or not can_move(order, status):
+                return None
+            if order_id is not None and order.get("id") != order_id:
+                return None
+            events = [{"op": "status", "user": user_id, "status": status}]
+            if status == PAID:
+                events.append({"op": "status", "user": user_id, "status": CLOSED})
+                events.append({"op": "close", "user": user_id})
+            await self._write(*events)
+            return order
@@ -0,0 +1,266 @@
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+from collections import deque
+
+# -----------------------------
+# Outbound WhatsApp send queue
+# -----------------------------
+# Handlers collect the messages of one turn in an Outbox and hand them to
+# the SendQueue, which:
+#   - persists them first (sqlite), so a restart resumes unsent messages
+#   - sends per recipient strictly in order, different recipients
+#     concurrently over the shared Graph pool
+#   - throttles all sends with a token bucket (WhatsApp per-number limits)
+#   - retries 429 / 5xx / network errors with exponential backoff,
+#     honouring Retry-After; other 4xx are dropped as dead letters
+# The worker that produced the turn never waits for Graph round trips.
+# sqlite writes (commit per turn / per delivery) run in a worker thread,
+# never on the event loop.
+
+SEND_RATE = 50.0  # messages / second
+SEND_BURST = 20
+MAX_ATTEMPTS = 6
+BASE_BACKOFF = 0.5  # seconds
+MAX_BACKOFF = 30.0
+
+
+class Outbox:
+    """
+    Messages produced while handling one turn, in the order they were queued.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, payload):
+        self.messages.append(payload)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.throttled = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            self.throttled += 1
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _retry_after(res):
+    if res is None:
+        return None
+    value = res.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class SendQueue:
+    def __init__(
+        self,
+        send,
+        path,
+        rate=SEND_RATE,
+        burst=SEND_BURST,
+        max_attempts=MAX_ATTEMPTS,
+        base_backoff=BASE_BACKOFF,
+        max_backoff=MAX_BACKOFF,
+        latency_window=500,
+    ):
+        """
+        send: async fn(payload) -> httpx.Response (one Graph API call)
+        path: sqlite file holding not-yet-delivered messages
+        """
+        self.send = send
+        self.path = path
+        self.bucket = TokenBucket(rate, burst)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.conn = None
+        self._db_lock = threading.Lock()  # the connection is used from worker threads
+        self._enqueue_lock = asyncio.Lock()  # turns are scheduled in the order they came
+
+        self._pending = {}  # recipient -> deque of [row_id, payload, attempts]
+        self._lanes = {}  # recipient -> task draining its deque
+
+        self._latencies = deque(maxlen=latency_window)
+        self.sent = 0
+        self.retries = 0
+        self.dead = 0
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    def open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient  TEXT NOT NULL,
+                payload    TEXT NOT NULL,
+                attempts   INTEGER NOT NULL DEFAULT 0,
+                status     TEXT NOT NULL DEFAULT 'pending',
+                last_error TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, id)"
+        )
+
+    async def start(self):
+        """
+        Resume whatever was still pending when the process stopped.
+        """
+        rows = self.conn.execute(
+            "SELECT id, recipient, payload, attempts FROM outbox WHERE status = 'pending' ORDER BY id"
+        ).fetchall()
+        for row_id, recipient, payload, attempts in rows:
+            self._push(recipient, [row_id, json.loads(payload), attempts])
+        if rows:
+            print(f"Outbox: resuming {len(rows)} unsent messages")
+
+    async def stop(self, timeout=10.0):
+        lanes = list(self._lanes.values())
+        if lanes:
+            await asyncio.wait(lanes, timeout=timeout)
+        for task in list(self._lanes.values()):
+            task.cancel()
+        await asyncio.gather(*self._lanes.values(), return_exceptions=True)
+        with self._db_lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    # -----------------------------
+    # Enqueue
+    # -----------------------------
+    async def enqueue(self, messages):
+        """
+        Persist a turn's messages in one transaction, then schedule them.
+        """
+        if not messages:
+            return
+        async with self._enqueue_lock:
+            rows = await asyncio.to_thread(self._insert, messages)
+            for recipient, row_id, payload in rows:
+                self._push(recipient, [row_id, payload, 0])
+
+    def _insert(self, messages):
+        now = time.time()
+        rows = []
+        with self._db_lock, self.conn:
+            for payload in messages:
+                recipient = str(payload.get("to"))
+                cur = self.conn.execute(
+                    "INSERT INTO outbox (recipient, payload, created_at) VALUES (?, ?, ?)",
+                    (recipient, json.dumps(payload, ensure_ascii=False), now),
+                )
+                rows.append((recipient, cur.lastrowid, payload))
+        return rows
+
+    def _execute(self, sql, params):
+        with self._db_lock, self.conn:
+            self.conn.execute(sql, params)
+
+    def _push(self, recipient, entry):
+        self._pending.setdefault(recipient, deque()).append(entry)
+        if recipient not in self._lanes:
+            self._lanes[recipient] = asyncio.create_task(self._run_lane(recipient))
+
+    # -----------------------------
+    # Sending
+    # -----------------------------
+    async def _run_lane(self, recipient):
+        queue = self._pending[recipient]
+        try:
+            while queue:
+                await self._deliver(queue[0])
+                queue.popleft()
+        finally:
+            del self._lanes[recipient]
+            if not queue:
+                del self._pending[recipient]
+
+    async def _deliver(self, entry):
+        row_id, payload, attempts = entry
+        while True:
+            await self.bucket.acquire()
+            started = time.perf_counter()
+            res = None
+            try:
+                res = await self.send(payload)
+                error = None if res.status_code < 300 else f"HTTP {res.status_code}"
+            except Exception as e:
+                error = repr(e)
+            self._latencies.append(time.perf_counter() - started)
+
+            if error is None:
+                self.sent += 1
+                await asyncio.to_thread(self._execute, "DELETE FROM outbox WHERE id = ?", (row_id,))
+                return
+
+            attempts += 1
+            entry[2] = attempts
+            retryable = res is None or res.status_code == 429 or res.status_code >= 500
+            if not retryable or attempts >= self.max_attempts:
+                self.dead += 1
+                print(f"WA send dropped after {attempts} attempts: {error}")
+                await asyncio.to_thread(
+                    self._execute,
+                    "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                    (attempts, error, row_id),
+                )
+                return
+
+            self.retries += 1
+            await asyncio.to_thread(
+                self._execute,
+                "UPDATE outbox SET attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, error, row_id),
+            )
+            delay = _retry_after(res)
+            if delay is None:
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+                delay = random.uniform(backoff / 2, backoff)
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        lat = sorted(self._latencies)
+
+        def pick(q):
+            return round(lat[min(len(lat) - 1, int(len(lat) * q))] * 1000, 1)
+
+        return {
+            "pending": sum(len(q) for q in self._pending.values()),
+            "active_recipients": len(self._lanes),
+            "sent": self.sent,
+            "retries": self.retries,
+            "dead": self.dead,
+            "throttled": self.bucket.throttled,
+            "latency_ms": {"p50": pick(0.5), "p95": pick(0.95), "max": pick(1.0)}
+            if lat
+            else None,
+        }
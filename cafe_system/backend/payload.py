@@ -0,0 +1,32 @@
+# -----------------------------
+# WhatsApp webhook payload walker
+# -----------------------------
+# Under load Meta batches several entries / changes / messages into one
+# POST. Walk all of them instead of only entry[0].changes[0].messages[0].
+
+
+def iter_payload(data):
+    """
+    Lazily yield every item in a webhook payload:
+      ("message", msg)     for each value.messages[*]
+      ("status", status)   for each value.statuses[*] (delivery receipts)
+    Malformed parts are skipped instead of aborting the whole payload.
+    """
+    if not isinstance(data, dict):
+        return
+    for entry in data.get("entry") or []:
+        if not isinstance(entry, dict):
+            continue
+        for change in entry.get("changes") or []:
+            if not isinstance(change, dict):
+                continue
+            value = change.get("value")
+            if not isinstance(value, dict):
+                continue
+            for kind, key in (("message", "messages"), ("status", "statuses")):
+                items = value.get(key)
+                if not isinstance(items, list):
+                    continue
+                for item in items:
+                    if isinstance(item, dict):
+                        yield kind, item
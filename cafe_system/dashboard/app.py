@@ -1,59 +1,22 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import json
 from datetime import datetime
-import time
-import os
+
+from utils.charts import category_pies, day_of_week_chart, hourly_chart, top_items_by_category_chart
+from utils.data_loaders import data_version
+from utils.filters import sidebar_filters
+from utils.metrics import compute_kpis, load_rollups, top_items
 
 # ---------------- CONFIG ----------------
 st.set_page_config(page_title="Cafe POS Dashboard", layout="wide")
 
-DATA_PATH = r"D:\Downloads\coding project\WA-POS\cafe_system\backend\orders_log.json"  # Adjust path if needed
-REFRESH_INTERVAL = 10  # seconds
-
-# ---------------- LOAD DATA ----------------
-@st.cache_data(ttl=30)
-def load_orders():
-    if not os.path.exists(DATA_PATH):
-        return pd.DataFrame(columns=["table", "timestamp", "item", "qty", "price", "subtotal"])
-        # st.warning("Orders data file not found.")
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-        # st.write(data)
-
-    records = []
-    for user, info in data.items():
-        table = info.get("table", "N/A")
-        timestamp = info.get("timestamp", "")
-        for item in info.get("order", []):
-            records.append({
-                "user": user,
-                "table": table,
-                "timestamp": timestamp,
-                "item": item["name"],
-                "qty": item["qty"],
-                "price": item["price"],
-                "subtotal": item["subtotal"],
-                "category": item.get("category", "Uncategorized")
-            })
-    return pd.DataFrame(records)
-
-# ---------------- KPI COMPUTE ----------------
-def compute_kpis(df):
-    gross_sales = df["subtotal"].sum()
-    net_sales = gross_sales * 0.995
-    gross_profit = net_sales
-    transactions = df["user"].nunique()
-    avg_sale = gross_sales / transactions if transactions else 0
-    gross_margin = (gross_profit / gross_sales * 100) if gross_sales else 0
-    return gross_sales, net_sales, gross_profit, transactions, avg_sale, gross_margin
+REFRESH_INTERVAL = 10  # seconds between data version checks
 
 # ---------------- TABLE STATISTICS ----------------
 def table_statistics(df):
-    table_stats = df.groupby("table").agg(
+    table_stats = df.groupby("table", observed=True).agg(
         total_sales=("subtotal", "sum"),
-        order_count=("user", "nunique"),
+        order_count=("order_id", "nunique"),
         last_order_time=("timestamp", "max")
     ).reset_index()
 
@@ -63,19 +26,35 @@ def table_statistics(df):
 
 # ---------------- MAIN DASHBOARD ----------------
 st.title("📊 Cafe POS Dashboard")
-st.markdown("#### Real-Time Sales Overview (auto-refresh every 10s)")
+st.markdown(f"#### Real-Time Sales Overview (refreshes when new orders arrive, checked every {REFRESH_INTERVAL}s)")
+
+# Auto refresh: a small fragment polls the data version on a timer and
+# reruns the page only when it changed. Nothing blocks the script run.
+# A full run records the version it rendered; fragment runs compare to it.
+st.session_state.data_version = data_version()
+
+
+@st.fragment(run_every=REFRESH_INTERVAL)
+def watch_data():
+    if data_version() != st.session_state.data_version:
+        st.rerun()
 
-# Auto refresh
-st_autorefresh = st.empty()
-time.sleep(REFRESH_INTERVAL)
 
-df = load_orders()
-if df.empty:
+watch_data()
+
+# KPIs and charts read the pre-aggregated rollups (see utils/metrics)
+rollups = load_rollups()
+if rollups.items.empty and not rollups.data.archive_days():
     st.info("No orders available yet. Waiting for new data...")
     st.stop()
 
+view = sidebar_filters(rollups)
+if view.items.empty:
+    st.info("No orders match the selected filters.")
+    st.stop()
+
 # KPI metrics
-gross_sales, net_sales, gross_profit, transactions, avg_sale, margin = compute_kpis(df)
+gross_sales, net_sales, gross_profit, transactions, avg_sale, margin = compute_kpis(view)
 
 col1, col2, col3 = st.columns(3)
 col4, col5, col6 = st.columns(3)
@@ -90,59 +69,29 @@ col6.metric("Gross Margin", f"{margin:.2f}%")
 # ---------------- SALES CHARTS ----------------
 st.markdown("### 📈 Sales Performance")
 
-# Convert timestamp
-df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-df["day"] = df["timestamp"].dt.day_name()
-df["hour"] = df["timestamp"].dt.hour
-
 col_a, col_b = st.columns(2)
 
 # Day of week chart
-day_chart = (
-    df.groupby("day")["subtotal"].sum().reindex(
-        ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-    )
-)
-col_a.plotly_chart(px.bar(day_chart, x=day_chart.index, y=day_chart.values,
-                          title="Day of Week - Gross Sales (Rp)",
-                          color=day_chart.index), use_container_width=True)
+col_a.plotly_chart(day_of_week_chart(view, "Day of Week - Gross Sales (Rp)"), use_container_width=True)
 
 # Hourly sales chart
-hour_chart = df.groupby("hour")["subtotal"].sum()
-col_b.plotly_chart(px.area(hour_chart, x=hour_chart.index, y=hour_chart.values,
-                           title="Hourly Gross Sales (Rp)",
-                           line_shape="spline"), use_container_width=True)
+col_b.plotly_chart(hourly_chart(view, "Hourly Gross Sales (Rp)"), use_container_width=True)
 
 # ---------------- TOP ITEMS ----------------
 st.markdown("### 🍽️ Top Selling Items")
-top_items = (
-    df.groupby("item", as_index=False)
-      .agg({"qty": "sum", "subtotal": "sum"})
-      .sort_values("subtotal", ascending=False)
-)
-st.dataframe(top_items.head(10), use_container_width=True)
+st.dataframe(top_items(view).head(10), use_container_width=True)
 
 # ---------------- CATEGORY ANALYSIS ----------------
 st.markdown("### 🥤 Category Insights")
 
-cat_sales = df.groupby("category", as_index=False).agg(
-    {"qty": "sum", "subtotal": "sum"}
-)
+by_volume, by_sales = category_pies(view)
 col_x, col_y = st.columns(2)
-col_x.plotly_chart(px.pie(cat_sales, names="category", values="qty", title="Category by Volume"),
-                   use_container_width=True)
-col_y.plotly_chart(px.pie(cat_sales, names="category", values="subtotal", title="Category by Sales"),
-                   use_container_width=True)
+col_x.plotly_chart(by_volume, use_container_width=True)
+col_y.plotly_chart(by_sales, use_container_width=True)
 
 # ---------------- TOP ITEMS BY CATEGORY ----------------
 st.markdown("### 🏆 Top Items by Category")
-for cat, group in df.groupby("category"):
-    st.subheader(cat)
-    chart = group.groupby("item")["qty"].sum().sort_values(ascending=False)
-    st.plotly_chart(px.bar(chart, x=chart.index, y=chart.values,
-                           title=f"{cat} - Top Items",
-                           color=chart.values, text_auto=True),
-                    use_container_width=True)
+st.plotly_chart(top_items_by_category_chart(view), use_container_width=True)
 
 # # ---------------- TABLE STATISTICS ----------------
 # st.markdown("### 🏷️ Table Statistics")
@@ -1,41 +1,21 @@
 import streamlit as st
-import pandas as pd
-import json
-import os
 
-DATA_PATH = "../backend/orders_log.json"
-
-@st.cache_data(ttl=30)
-def load_orders():
-    if not os.path.exists(DATA_PATH):
-        return pd.DataFrame()
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    rows = []
-    for user, info in data.items():
-        for item in info.get("order", []):
-            rows.append({
-                "item": item["name"],
-                "qty": item["qty"],
-                "subtotal": item["subtotal"],
-                "category": item.get("category", "Uncategorized")
-            })
-    return pd.DataFrame(rows)
+from utils.filters import sidebar_filters
+from utils.metrics import load_rollups, top_items
 
 st.title("📦 Item Summary")
 
-df = load_orders()
-if df.empty:
+rollups = load_rollups()
+if rollups.items.empty and not rollups.data.archive_days():
     st.info("No item data yet.")
     st.stop()
 
-summary = (
-    df.groupby("item", as_index=False)
-      .agg({"qty": "sum", "subtotal": "sum"})
-      .sort_values("subtotal", ascending=False)
-)
-summary.rename(columns={"qty": "Item Sold", "subtotal": "Gross Sales (Rp)"}, inplace=True)
+view = sidebar_filters(rollups)
+if view.items.empty:
+    st.info("No orders match the selected filters.")
+    st.stop()
+
+summary = top_items(view).rename(columns={"qty": "Item Sold", "subtotal": "Gross Sales (Rp)"})
 
 st.markdown("### 🏆 Top 10 Items")
 st.dataframe(summary.head(10), use_container_width=True)
@@ -0,0 +1,78 @@
+import math
+
+import pandas as pd
+import plotly.express as px
+
+from utils.metrics import category_sales, items_by_category, sales_by_day, sales_by_hour
+
+
+# -----------------------------------------------------------
+# Chart builders
+# -----------------------------------------------------------
+# Figures are built from the rollups (utils/metrics) and memoized on the
+# rollup / filtered view, so each one is built once per data version and
+# filter instead of on every rerun and page. Bar series are capped before
+# they reach plotly: the figure JSON is what every refresh ships to the
+# browser.
+
+TOP_PER_CATEGORY = 10  # bars per category, the rest become "Other"
+FACET_COLUMNS = 2
+
+
+def day_of_week_chart(r, title):
+    def build():
+        chart = sales_by_day(r)
+        return px.bar(chart, x=chart.index, y=chart.values, title=title, color=chart.index)
+    return r.memo(("chart:day", title), build)
+
+
+def hourly_chart(r, title):
+    def build():
+        chart = sales_by_hour(r)  # at most 24 points
+        return px.area(chart, x=chart.index, y=chart.values, title=title, line_shape="spline")
+    return r.memo(("chart:hour", title), build)
+
+
+def category_pies(r):
+    """
+    (by volume, by sales) pie figures.
+    """
+    def build():
+        cat_sales = category_sales(r)
+        return (
+            px.pie(cat_sales, names="category", values="qty", title="Category by Volume"),
+            px.pie(cat_sales, names="category", values="subtotal", title="Category by Sales"),
+        )
+    return r.memo("chart:category_pies", build)
+
+
+def _top_per_category(items):
+    # items_by_category is sorted by qty within each category
+    rank = items.groupby("category").cumcount()
+    top = items[rank < TOP_PER_CATEGORY]
+    rest = items[rank >= TOP_PER_CATEGORY]
+    if rest.empty:
+        return top
+    other = rest.groupby("category", as_index=False)["qty"].sum().assign(item="Other")
+    return pd.concat([top, other], ignore_index=True)
+
+
+def top_items_by_category_chart(r, title="Top Items by Category"):
+    """
+    One faceted bar figure (a panel per category) instead of one figure
+    per category.
+    """
+    def build():
+        items = _top_per_category(items_by_category(r))
+        rows = math.ceil(items["category"].nunique() / FACET_COLUMNS)
+        fig = px.bar(
+            items, x="item", y="qty", color="qty", text_auto=True, title=title,
+            facet_col="category", facet_col_wrap=FACET_COLUMNS,
+            facet_row_spacing=min(0.5 / max(rows, 1), 0.12),
+            height=max(350, 320 * rows),
+        )
+        # each panel shows only its own items
+        fig.update_xaxes(matches=None, showticklabels=True, title_text="")
+        fig.for_each_annotation(lambda a: a.update(text=a.text.split("=", 1)[-1]))
+        return fig
+    return r.memo(("chart:top_items_by_category", title), build)
@@ -1,129 +1,502 @@
-# import json
-# import os
-# from datetime import datetime
+import os
+import glob
+import json
+import sqlite3
+import threading
+from datetime import date, timedelta
 
+import numpy as np
+import pandas as pd
+import streamlit as st
 
-# # -----------------------------------------------------------
-# # Paths
-# # -----------------------------------------------------------
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # optional: without it the JSONL archive is read instead
+    pq = None
 
-# # Base folder: cafe_system/
-# BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 
-# # The backend folder contains orders_log.json
-# ORDERS_FILE = os.path.join(BASE_DIR, "backend", "orders_log.json")
+# -----------------------------------------------------------
+# Paths
+# -----------------------------------------------------------
 
+# Base folder: cafe_system/
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# # -----------------------------------------------------------
-# # JSON Utilities
-# # -----------------------------------------------------------
-
-# def safe_load_json(file_path):
-#     """Read JSON safely and return empty dict if broken."""
-#     if not os.path.exists(file_path):
-#         return {}
+# Live orders (refreshed by the backend) and the dated archive of closed orders
+ORDERS_FILE = os.getenv("ORDERS_FILE", os.path.join(BASE_DIR, "backend", "orders_log.json"))
+ARCHIVE_DIR = os.getenv("ORDERS_ARCHIVE_DIR", os.path.join(BASE_DIR, "backend", "archive"))
+# Parquet copy of finished archive days (backend/archive_parquet.py)
+PARQUET_DIR = os.path.join(ARCHIVE_DIR, "parquet")
+# With the SQLite backend the live orders are read from its database
+ORDERS_BACKEND = os.getenv("ORDERS_BACKEND", "journal")  # "journal" | "sqlite"
+ORDERS_DB = os.getenv("ORDERS_DB", os.path.join(BASE_DIR, "backend", "orders.db"))
 
-#     try:
-#         with open(file_path, "r") as f:
-#             return json.load(f)
-#     except json.JSONDecodeError:
-#         return {}
-
-
-# def safe_save_json(file_path, data):
-#     """Safely save JSON with pretty formatting."""
-#     with open(file_path, "w") as f:
-#         json.dump(data, f, indent=4)
-
-
-# # -----------------------------------------------------------
-# # Order Data Loaders
-# # -----------------------------------------------------------
-
-# def load_orders():
-#     """
-#     Load all orders from backend/orders_log.json.
-#     Returns structure:
-
-#     {
-#         "user_123": {
-#             "table": "A1",
-#             "order": [
-#                 {"item": "Fries", "qty": 2, "price": 10000},
-#                 {"item": "Salmon", "qty": 1, "price": 45000}
-#             ],
-#             "total": 65000,
-#             "timestamp": "2025-11-16 12:45:11.123123"
-#         }
-#     }
-#     """
-#     return safe_load_json(ORDERS_FILE)
-
-
-# def save_orders(orders_data):
-#     """Overwrite the entire orders JSON file."""
-#     safe_save_json(ORDERS_FILE, orders_data)
-
-
-# # -----------------------------------------------------------
-# # Helper Functions for Analytics
-# # -----------------------------------------------------------
-
-# def get_orders_list():
-#     """Return all orders as a list instead of dict."""
-#     orders = load_orders()
-#     return [
-#         {**v, "user_id": k}
-#         for k, v in orders.items()
-#     ]
-
-
-# def get_orders_by_table(table_number):
-#     """Return all orders for a specific table."""
-#     orders = load_orders()
-#     return {
-#         uid: data for uid, data in orders.items()
-#         if data.get("table") == table_number
-#     }
-
-
-# def get_latest_order_time():
-#     """Return the most recent order timestamp."""
-#     orders = load_orders()
-#     if not orders:
-#         return None
-
-#     timestamps = [
-#         datetime.strptime(data["timestamp"], "%Y-%m-%d %H:%M:%S.%f")
-#         for data in orders.values()
-#     ]
-#     return max(timestamps)
-
-
-# def get_unique_tables():
-#     """Return list of tables that have active orders."""
-#     orders = load_orders()
-#     return sorted({data["table"] for data in orders.values()})
-
-
-# def count_total_items():
-#     """Total number of items ordered across all tables."""
-#     orders = load_orders()
-#     count = 0
-#     for data in orders.values():
-#         for item in data["order"]:
-#             count += item.get("qty", 0)
-#     return count
-
-
-# # -----------------------------------------------------------
-# # Data conversion helpers
-# # -----------------------------------------------------------
-
-# def convert_timestamp(ts: str):
-#     """Convert timestamp string into datetime object."""
-#     try:
-#         return datetime.strptime(ts, "%Y-%m-%d %H:%M:%S.%f")
-#     except ValueError:
-#         # fallback if microseconds are missing
-#         return datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
+# Archive days loaded up front; picking an earlier start date in the
+# sidebar loads further back. 0 = everything.
+HISTORY_DAYS = int(os.getenv("DASHBOARD_HISTORY_DAYS", "90"))
+
+
+# -----------------------------------------------------------
+# Schema
+# -----------------------------------------------------------
+# One row per order line. Strings are dictionary-encoded (pandas
+# categoricals), amounts are int64 rupiah, timestamps datetime64[ns].
+
+CATEGORICAL = ["order_id", "user", "table", "status", "item", "category"]
+INTEGER = ["qty", "price", "subtotal"]
+COLUMNS = ["order_id", "user", "table", "status", "timestamp", "item", "qty", "price", "subtotal", "category"]
+
+_NAT = np.iinfo(np.int64).min  # datetime64 NaT as int64
+
+
+def _order_rows(user, info, rows):
+    """
+    Flatten one stored order into rows (dicts keyed by COLUMNS).
+    """
+    timestamp = info.get("timestamp", "")
+    # one order per visit; older entries without an id count once per user
+    order_id = info.get("id") or f"{user}@{timestamp}"
+    for item in info.get("order", []):
+        rows.append({
+            "order_id": order_id,
+            "user": user,
+            "table": info.get("table") or "N/A",
+            "status": info.get("status"),
+            "timestamp": timestamp,
+            "item": item["name"],
+            "qty": item["qty"],
+            "price": item["price"],
+            "subtotal": item["subtotal"],
+            "category": item.get("category") or "Uncategorized",
+        })
+
+
+# -----------------------------------------------------------
+# Parquet history
+# -----------------------------------------------------------
+# archive/parquet/date=YYYY-MM-DD/orders.parquet, one partition per
+# finished archive day. Like the JSONL files, partitions are dated by the
+# day orders CLOSED, while the dashboard filters on the day they opened.
+# An order never closes before it opens, so every order opened on or
+# after `start` is in a partition dated >= start: days before it are
+# skipped by directory name, before anything is opened (partition
+# pruning). Only the loader's columns are read (column projection: the
+# archive-only closed_at is never loaded).
+
+def partition_days(start=None, parquet_dir=PARQUET_DIR):
+    """
+    Days ("YYYY-MM-DD", oldest first) with a Parquet partition, from
+    start (a date or string, inclusive) on when given.
+    """
+    days = []
+    for path in sorted(glob.glob(os.path.join(parquet_dir, "date=*"))):
+        day = os.path.basename(path)[len("date="):]
+        if start is not None and day < str(start):
+            continue
+        days.append(day)
+    return days
+
+
+def partition_path(day, parquet_dir=PARQUET_DIR):
+    return os.path.join(parquet_dir, f"date={day}", "orders.parquet")
+
+
+def read_partition(day, columns=None, parquet_dir=PARQUET_DIR):
+    """
+    (DataFrame, JSONL bytes it was built from) for one day. Dictionary
+    columns come back as categoricals.
+    """
+    table = pq.read_table(partition_path(day, parquet_dir), columns=columns)
+    metadata = pq.read_schema(partition_path(day, parquet_dir)).metadata or {}
+    return table.to_pandas(), int(metadata.get(b"source_bytes", 0))
+
+
+# -----------------------------------------------------------
+# SQLite live orders
+# -----------------------------------------------------------
+# backend/order_db keeps the database in WAL mode; a read-only connection
+# never takes the write lock, so the dashboard reads while the webhook
+# writes. Live visits are the rows with closed_at NULL (indexed).
+
+LIVE_QUERY = """
+SELECT o.order_ref, o.user, o.table_no, o.status, o.timestamp,
+       i.name, i.qty, i.price, i.subtotal, i.category
+FROM orders o JOIN order_items i ON i.order_id = o.id
+WHERE o.closed_at IS NULL
+ORDER BY o.id, i.position
+"""
+
+
+def connect_readonly(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+# -----------------------------------------------------------
+# Incremental column store
+# -----------------------------------------------------------
+
+class OrderData:
+    """
+    All order lines as growable numpy columns, shared by every session
+    and page (see get_order_data()).
+
+    refresh() only parses what changed since the last call:
+      - archive files are append-only, so each one is read from the byte
+        offset where the previous refresh stopped; a day that has a
+        Parquet partition is loaded from it instead (typed columns, no
+        JSON parsing) and its JSONL only from where the partition ends
+      - orders_log.json only holds the live orders (a small set); it is
+        re-read when its mtime / size changes and its rows replace the
+        previous live rows at the tail of the columns. Given db_path (the
+        SQLite backend), the live orders are queried from the database
+        instead, whenever PRAGMA data_version says it was written to
+
+    Only archive days from `since` on are loaded (see "Parquet history"
+    for why that covers every order opened since then); extend_to()
+    moves it back and the next refresh() loads the older days.
+    """
+
+    def __init__(self, orders_file=ORDERS_FILE, archive_dir=ARCHIVE_DIR, capacity=4096,
+                 history_days=HISTORY_DAYS, db_path=None):
+        self.orders_file = orders_file
+        self.db_path = db_path
+        self._db = None
+        self.archive_dir = archive_dir
+        self.parquet_dir = os.path.join(archive_dir, "parquet")
+        self.since = str(date.today() - timedelta(days=history_days)) if history_days else None
+        self.version = 0
+
+        self._n = 0  # rows in use
+        self._n_archived = 0  # archive rows come first, live rows after
+        self._capacity = capacity
+        self._ints = {c: np.zeros(capacity, dtype=np.int64) for c in INTEGER}
+        self._timestamps = np.full(capacity, _NAT, dtype=np.int64)
+        self._codes = {c: np.zeros(capacity, dtype=np.int32) for c in CATEGORICAL}
+        self._dicts = {c: {} for c in CATEGORICAL}  # value -> code
+        self._values = {c: [] for c in CATEGORICAL}  # code -> value
+
+        self._offsets = {}  # archive path -> bytes consumed
+        self._archived_ids = set()
+        self._live_stat = None
+        self._live_rows = []
+        self._frame = None
+        self._frame_version = -1
+        self._lock = threading.Lock()
+
+    # ---------------- reading ----------------
+    def _read_parquet(self, path):
+        """
+        Load an archive day from its Parquet partition if it has one and
+        nothing of it was read yet. Returns the frame or None.
+        """
+        if pq is None or path in self._offsets:
+            return None
+        day = os.path.basename(path)[len("orders-"):-len(".jsonl")]
+        if not os.path.exists(partition_path(day, self.parquet_dir)):
+            return None
+        frame, source_bytes = read_partition(day, COLUMNS, self.parquet_dir)
+        self._offsets[path] = source_bytes
+        self._archived_ids.update(frame["order_id"].dropna().unique())
+        return frame
+
+    def archive_days(self):
+        """
+        Every archived day, loaded or not (JSONL or Parquet), oldest first.
+        """
+        days = {
+            os.path.basename(p)[len("orders-"):-len(".jsonl")]
+            for p in glob.glob(os.path.join(self.archive_dir, "orders-*.jsonl"))
+        }
+        # days whose JSONL was pruned after compaction
+        days.update(partition_days(parquet_dir=self.parquet_dir) if pq else ())
+        return sorted(days)
+
+    def extend_to(self, start):
+        """
+        Make sure orders opened from `start` (a date) on are loaded.
+        Returns True if older days have to be read (call refresh()).
+        """
+        with self._lock:
+            if start is None or self.since is None or str(start) >= self.since:
+                return False
+            self.since = str(start)
+            return True
+
+    def _read_archive(self):
+        """
+        (frames, rows) of archive order lines not loaded yet.
+        """
+        frames, rows = [], []
+        for day in self.archive_days():
+            if self.since is not None and day < self.since:
+                continue  # pruned: closed before the window, so opened before it too
+            path = os.path.join(self.archive_dir, f"orders-{day}.jsonl")
+            frame = self._read_parquet(path)
+            if frame is not None:
+                frames.append(frame)
+            offset = self._offsets.get(path, 0)
+            if not os.path.exists(path) or os.path.getsize(path) <= offset:
+                continue
+            with open(path, "rb") as f:
+                f.seek(offset)
+                chunk = f.read()
+            # only whole lines; a line still being written is read next time
+            end = chunk.rfind(b"\n") + 1
+            for line in chunk[:end].splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # blank / torn line
+                if not isinstance(record, dict) or "user" not in record:
+                    continue
+                _order_rows(record["user"], record, rows)
+                self._archived_ids.add(record.get("id") or f"{record['user']}@{record.get('timestamp', '')}")
+            self._offsets[path] = offset + end
+        return frames, rows
+
+    def _read_live(self):
+        """
+        (changed, rows) for orders_log.json (or the database).
+        """
+        if self.db_path is not None:
+            return self._read_live_db()
+        try:
+            info = os.stat(self.orders_file)
+        except FileNotFoundError:
+            changed = self._live_stat is not None
+            self._live_stat = None
+            return changed, []
+        stat = (info.st_mtime_ns, info.st_size)
+        if stat == self._live_stat:
+            return False, None
+        try:
+            with open(self.orders_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            return False, None  # mid-write; next refresh picks it up
+        self._live_stat = stat
+        rows = []
+        for user, info in data.items():
+            _order_rows(user, info, rows)
+        return True, rows
+
+    def _read_live_db(self):
+        """
+        (changed, rows) for the SQLite backend's live visits.
+        """
+        if self._db is None:
+            if not os.path.exists(self.db_path):
+                return False, None
+            self._db = connect_readonly(self.db_path)
+        # bumped whenever another connection commits
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._live_stat:
+            return False, None
+        rows = []
+        for r in self._db.execute(LIVE_QUERY):
+            rows.append({
+                "order_id": r["order_ref"] or f"{r['user']}@{r['timestamp']}",
+                "user": r["user"],
+                "table": r["table_no"] or "N/A",
+                "status": r["status"],
+                "timestamp": r["timestamp"],
+                "item": r["name"],
+                "qty": r["qty"],
+                "price": r["price"],
+                "subtotal": r["subtotal"],
+                "category": r["category"] or "Uncategorized",
+            })
+        self._live_stat = version
+        return True, rows
+
+    # ---------------- appending ----------------
+    def _grow(self, needed):
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        if capacity == self._capacity:
+            return
+        for c in INTEGER:
+            self._ints[c] = np.resize(self._ints[c], capacity)
+        for c in CATEGORICAL:
+            self._codes[c] = np.resize(self._codes[c], capacity)
+        self._timestamps = np.resize(self._timestamps, capacity)
+        self._capacity = capacity
+
+    def _encode(self, column, value):
+        if value is None:
+            return -1
+        value = str(value)
+        code = self._dicts[column].get(value)
+        if code is None:
+            code = len(self._values[column])
+            self._dicts[column][value] = code
+            self._values[column].append(value)
+        return code
+
+    def _append(self, rows):
+        if not rows:
+            return
+        start, end = self._n, self._n + len(rows)
+        self._grow(end)
+        for c in INTEGER:
+            self._ints[c][start:end] = np.fromiter((int(r[c]) for r in rows), np.int64, len(rows))
+        for c in CATEGORICAL:
+            self._codes[c][start:end] = np.fromiter(
+                (self._encode(c, r[c]) for r in rows), np.int32, len(rows)
+            )
+        stamps = pd.to_datetime([r["timestamp"] for r in rows], errors="coerce", format="ISO8601")
+        self._timestamps[start:end] = stamps.as_unit("ns").asi8
+        self._n = end
+
+    def _append_frame(self, frame):
+        """
+        Append typed columns (a Parquet partition): categories are mapped
+        onto this store's codes, no per-row Python work.
+        """
+        if frame.empty:
+            return
+        start, end = self._n, self._n + len(frame)
+        self._grow(end)
+        for c in INTEGER:
+            self._ints[c][start:end] = frame[c].to_numpy(np.int64)
+        for c in CATEGORICAL:
+            column = frame[c].astype("category")
+            codes = column.cat.codes.to_numpy()
+            mapping = np.array(
+                [self._encode(c, v) for v in column.cat.categories] + [-1], dtype=np.int32
+            )
+            self._codes[c][start:end] = mapping[codes]  # code -1 (missing) -> last entry
+        self._timestamps[start:end] = frame["timestamp"].to_numpy("datetime64[ns]").view(np.int64)
+        self._n = end
+
+    def refresh(self):
+        """
+        Pick up new archive lines / a rewritten orders_log.json.
+        Returns True if anything changed.
+        """
+        with self._lock:
+            frames, archived = self._read_archive()
+            live_changed, live_rows = self._read_live()
+            if not frames and not archived and not live_changed:
+                return False
+            if live_changed:
+                self._live_rows = live_rows
+            # Drop the live tail, append the new archive rows, then the
+            # live rows again (minus orders that were archived meanwhile:
+            # the backend refreshes orders_log.json a little later).
+            self._n = self._n_archived
+            for frame in frames:
+                self._append_frame(frame)
+            self._append(archived)
+            self._n_archived = self._n
+            self._append([r for r in self._live_rows if r["order_id"] not in self._archived_ids])
+            self.version += 1
+            return True
+
+    # ---------------- output ----------------
+    def _build(self, start, end):
+        data = {}
+        for c in COLUMNS:
+            if c in INTEGER:
+                data[c] = self._ints[c][start:end].copy()
+            elif c == "timestamp":
+                data[c] = self._timestamps[start:end].copy().view("datetime64[ns]")
+            else:
+                data[c] = pd.Categorical.from_codes(
+                    self._codes[c][start:end].copy(), categories=list(self._values[c])
+                )
+        return pd.DataFrame(data, columns=COLUMNS)
+
+    def frame(self):
+        """
+        The current rows as a typed DataFrame (rebuilt only when the
+        version changed). Callers get a shallow copy, so adding columns
+        never leaks into other sessions.
+        """
+        with self._lock:
+            if self._frame_version != self.version or self._frame is None:
+                self._frame = self._build(0, self._n)
+                self._frame_version = self.version
+            return self._frame.copy(deep=False)
+
+    def changes(self, archived_from):
+        """
+        (version, new archive rows from row `archived_from` on, live rows,
+        archived row count): what an incremental consumer such as the
+        rollups in utils/metrics needs after a refresh. Archive rows never
+        change once appended; the live rows are replaced on every refresh.
+        """
+        with self._lock:
+            return (
+                self.version,
+                self._build(archived_from, self._n_archived),
+                self._build(self._n_archived, self._n),
+                self._n_archived,
+            )
+
+    def count_orders(self, start=None, end=None, tables=(), categories=()):
+        """
+        Distinct orders with at least one line matching the filters
+        (dates inclusive), counted on the codes without building a frame.
+        """
+        with self._lock:
+            n = self._n
+            mask = np.ones(n, dtype=bool)
+            stamps = self._timestamps[:n]
+            if start is not None:
+                mask &= stamps >= pd.Timestamp(start).as_unit("ns").value
+            if end is not None:
+                mask &= stamps < (pd.Timestamp(end) + pd.Timedelta(days=1)).as_unit("ns").value
+            for column, values in (("table", tables), ("category", categories)):
+                if values:
+                    codes = [self._dicts[column][v] for v in values if v in self._dicts[column]]
+                    mask &= np.isin(self._codes[column][:n], codes)
+            return len(np.unique(self._codes["order_id"][:n][mask]))
+
+    def stats(self):
+        return {
+            "rows": self._n,
+            "archived_rows": self._n_archived,
+            "version": self.version,
+            "since": self.since,
+        }
+
+
+# -----------------------------------------------------------
+# Shared loader
+# -----------------------------------------------------------
+
+@st.cache_resource
+def get_order_data():
+    """One OrderData per server process, shared by all sessions / pages."""
+    return OrderData(db_path=ORDERS_DB if ORDERS_BACKEND == "sqlite" else None)
+
+
+def load_orders():
+    """
+    All order lines (live + archived) as a DataFrame with the schema above.
+    """
+    data = get_order_data()
+    data.refresh()
+    return data.frame()
+
+
+def data_version():
+    """
+    Cheap fingerprint of the data files (stat only, no reads). Changes
+    whenever the backend rewrites orders_log.json (writes the database)
+    or archives an order.
+    """
+    live = [ORDERS_DB, ORDERS_DB + "-wal"] if ORDERS_BACKEND == "sqlite" else [ORDERS_FILE]
+    version = []
+    for path in live + sorted(glob.glob(os.path.join(ARCHIVE_DIR, "orders-*.jsonl"))):
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            continue
+        version.append((path, info.st_mtime_ns, info.st_size))
+    return tuple(version)
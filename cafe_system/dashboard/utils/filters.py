@@ -0,0 +1,53 @@
+import streamlit as st
+
+from utils.metrics import filter_options
+
+
+# -----------------------------------------------------------
+# Sidebar filters
+# -----------------------------------------------------------
+# Shared by every page. The selection is kept in session_state so it
+# survives page switches and auto refreshes; the filtering itself happens
+# in the rollups (Rollups.view), not on a loaded DataFrame.
+
+def sidebar_filters(rollups):
+    """
+    Draw the date / table / category filters and return the filtered
+    view of the rollups (the rollups themselves when nothing is set).
+    """
+    first, last, tables, categories = filter_options(rollups)
+
+    st.sidebar.title("Filters")
+    picked = st.sidebar.date_input(
+        "Date range",
+        value=st.session_state.get("filter_dates", ()),
+        min_value=first,
+        max_value=last,
+    )
+    st.session_state.filter_dates = picked
+    # while picking a range the widget briefly holds only the first date
+    start, end = (tuple(picked) + (None, None))[:2] if picked else (None, None)
+    if start is not None and end is None:
+        end = start
+    # older than the loaded history: read those archive days first
+    if rollups.data.extend_to(start):
+        rollups.refresh()
+    if rollups.data.since is not None:
+        st.sidebar.caption(
+            f"History loaded from {rollups.data.since}; pick an earlier start date to load more."
+        )
+
+    picked_tables = st.sidebar.multiselect(
+        "Tables",
+        tables,
+        default=[t for t in st.session_state.get("filter_tables", []) if t in tables],
+    )
+    st.session_state.filter_tables = picked_tables
+    picked_categories = st.sidebar.multiselect(
+        "Categories",
+        categories,
+        default=[c for c in st.session_state.get("filter_categories", []) if c in categories],
+    )
+    st.session_state.filter_categories = picked_categories
+
+    return rollups.view(start, end, picked_tables, picked_categories)
@@ -0,0 +1,262 @@
+import threading
+from collections import OrderedDict
+from datetime import date
+
+import pandas as pd
+import streamlit as st
+
+from utils.data_loaders import get_order_data
+
+
+# -----------------------------------------------------------
+# Rollups
+# -----------------------------------------------------------
+# The charts and KPIs only ever need sums per hour / item / table /
+# category, so instead of regrouping every order line on each rerun we
+# keep two small pre-aggregated tables and update them as orders arrive:
+#
+#   items:  hour x table x category x item -> qty, subtotal
+#   orders: hour x table                   -> orders, subtotal
+#
+# Archived orders never change, so their rollup only grows by the new
+# rows; the live orders (a small set) are re-rolled on each refresh and
+# added on top. Everything the pages show is derived from these tables
+# and memoized per rollup version.
+#
+# Sidebar filters (date range, tables, categories) are applied to the
+# rollups, whose keys are exactly those dimensions, not to a DataFrame of
+# all order lines. Each filter combination is a RollupView with its own
+# memo; the most recent MAX_VIEWS are kept per version.
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+ITEM_KEYS = ["hour", "table", "category", "item"]
+ORDER_KEYS = ["hour", "table"]
+
+MAX_VIEWS = 32  # filtered views kept per rollup version
+
+
+def _with_hour(lines):
+    lines = lines.copy(deep=False)
+    lines["hour"] = lines["timestamp"].dt.floor("h")
+    # plain strings, so rollups from different refreshes line up
+    for c in ["table", "category", "item"]:
+        lines[c] = lines[c].astype(str)
+    return lines
+
+
+def roll_items(lines):
+    if lines.empty:
+        return pd.DataFrame(columns=ITEM_KEYS + ["qty", "subtotal"])
+    lines = _with_hour(lines)
+    return lines.groupby(ITEM_KEYS, dropna=False, as_index=False)[["qty", "subtotal"]].sum()
+
+
+def roll_orders(lines):
+    if lines.empty:
+        return pd.DataFrame(columns=ORDER_KEYS + ["orders", "subtotal"])
+    lines = _with_hour(lines)
+    # an order's lines share its timestamp and table
+    return lines.groupby(ORDER_KEYS, dropna=False, as_index=False).agg(
+        orders=("order_id", "nunique"), subtotal=("subtotal", "sum")
+    )
+
+
+def merge(a, b, keys):
+    if a.empty:
+        return b
+    if b.empty:
+        return a
+    return pd.concat([a, b], ignore_index=True).groupby(keys, dropna=False, as_index=False).sum()
+
+
+class Rollups:
+    def __init__(self, data):
+        self.data = data  # utils.data_loaders.OrderData
+        self.version = -1
+        self.items = roll_items(pd.DataFrame())
+        self.orders = roll_orders(pd.DataFrame())
+        self._rolled = 0  # archive rows already in the archived rollups
+        self._archived_items = self.items
+        self._archived_orders = self.orders
+        self._memo = {}
+        self._views = OrderedDict()  # filter key -> RollupView, oldest first
+        self._lock = threading.RLock()  # memo builders call other memoized builders
+
+    def refresh(self):
+        """
+        Fold whatever OrderData picked up into the rollups.
+        """
+        self.data.refresh()
+        with self._lock:
+            if self.data.version == self.version:
+                return False
+            version, new_archived, live, n_archived = self.data.changes(self._rolled)
+            self._archived_items = merge(self._archived_items, roll_items(new_archived), ITEM_KEYS)
+            self._archived_orders = merge(self._archived_orders, roll_orders(new_archived), ORDER_KEYS)
+            self._rolled = n_archived
+            self.items = merge(self._archived_items, roll_items(live), ITEM_KEYS)
+            self.orders = merge(self._archived_orders, roll_orders(live), ORDER_KEYS)
+            self.version = version
+            self._memo = {}
+            self._views = OrderedDict()
+            return True
+
+    def memo(self, key, build):
+        """
+        build() once per rollup version.
+        """
+        with self._lock:
+            if key not in self._memo:
+                self._memo[key] = build()
+            return self._memo[key]
+
+    def transactions(self):
+        return int(self.orders["orders"].sum())
+
+    def view(self, start=None, end=None, tables=(), categories=()):
+        """
+        The rollups restricted to start..end (dates, inclusive), tables and
+        categories; an empty filter means everything. Returns self when
+        nothing is filtered.
+        """
+        key = (start, end, tuple(sorted(tables)), tuple(sorted(categories)))
+        if key == (None, None, (), ()):
+            return self
+        with self._lock:
+            view = self._views.get(key)
+            if view is not None:
+                self._views.move_to_end(key)
+                return view
+            view = RollupView(self, *key)
+            self._views[key] = view
+            while len(self._views) > MAX_VIEWS:
+                self._views.popitem(last=False)
+            return view
+
+
+def _hour_mask(frame, start, end):
+    mask = pd.Series(True, index=frame.index)
+    if start is not None:
+        mask &= frame["hour"] >= pd.Timestamp(start)
+    if end is not None:
+        mask &= frame["hour"] < pd.Timestamp(end) + pd.Timedelta(days=1)
+    return mask
+
+
+class RollupView:
+    """
+    One filter combination over Rollups: same interface (items,
+    transactions(), memo()), built from the rollup tables.
+    """
+
+    def __init__(self, rollups, start, end, tables, categories):
+        self.version = rollups.version
+        mask = _hour_mask(rollups.items, start, end)
+        if tables:
+            mask &= rollups.items["table"].isin(tables)
+        if categories:
+            mask &= rollups.items["category"].isin(categories)
+        self.items = rollups.items[mask]
+
+        if categories:
+            # an order can span categories, so count it on the order lines
+            self._transactions = rollups.data.count_orders(start, end, tables, categories)
+        else:
+            mask = _hour_mask(rollups.orders, start, end)
+            if tables:
+                mask &= rollups.orders["table"].isin(tables)
+            self._transactions = int(rollups.orders.loc[mask, "orders"].sum())
+        self._memo = {}
+        self._lock = threading.RLock()
+
+    def transactions(self):
+        return self._transactions
+
+    def memo(self, key, build):
+        with self._lock:
+            if key not in self._memo:
+                self._memo[key] = build()
+            return self._memo[key]
+
+
+@st.cache_resource
+def get_rollups():
+    """One Rollups per server process, shared by all sessions / pages."""
+    return Rollups(get_order_data())
+
+
+def load_rollups():
+    rollups = get_rollups()
+    rollups.refresh()
+    return rollups
+
+
+# -----------------------------------------------------------
+# Derived tables (all read the rollups, never the raw lines)
+# -----------------------------------------------------------
+
+def compute_kpis(r):
+    def build():
+        gross_sales = int(r.items["subtotal"].sum())
+        net_sales = gross_sales * 995 // 1000
+        gross_profit = net_sales
+        transactions = r.transactions()
+        avg_sale = gross_sales / transactions if transactions else 0
+        gross_margin = (gross_profit / gross_sales * 100) if gross_sales else 0
+        return gross_sales, net_sales, gross_profit, transactions, avg_sale, gross_margin
+    return r.memo("kpis", build)
+
+
+def sales_by_day(r):
+    def build():
+        days = r.items["hour"].dt.day_name()
+        return r.items.groupby(days)["subtotal"].sum().reindex(WEEKDAYS)
+    return r.memo("by_day", build)
+
+
+def sales_by_hour(r):
+    def build():
+        return r.items.groupby(r.items["hour"].dt.hour)["subtotal"].sum()
+    return r.memo("by_hour", build)
+
+
+def filter_options(r):
+    """
+    (first day, last day, tables, categories) for the sidebar filters.
+    Takes the Rollups themselves, not a filtered view.
+    """
+    def build():
+        hours = r.items["hour"].dropna()
+        first = hours.min().date() if len(hours) else None
+        last = hours.max().date() if len(hours) else None
+        # archive days not loaded yet (before OrderData.since) are pickable too
+        days = r.data.archive_days()
+        if days and (first is None or days[0] < str(first)):
+            first = date.fromisoformat(days[0])
+        return first, last, sorted(r.items["table"].unique()), sorted(r.items["category"].unique())
+    return r.memo("filter_options", build)
+
+
+def top_items(r):
+    def build():
+        return (
+            r.items.groupby("item", as_index=False)[["qty", "subtotal"]].sum()
+            .sort_values("subtotal", ascending=False)
+        )
+    return r.memo("top_items", build)
+
+
+def category_sales(r):
+    def build():
+        return r.items.groupby("category", as_index=False)[["qty", "subtotal"]].sum()
+    return r.memo("categories", build)
+
+
+def items_by_category(r):
+    def build():
+        return (
+            r.items.groupby(["category", "item"], as_index=False)["qty"].sum()
+            .sort_values(["category", "qty"], ascending=[True, False])
+        )
+    return r.memo("items_by_category", build)